@@ -0,0 +1,95 @@
+"""
+Discord のメッセージ編集・削除で発生する REST 呼び出しの数と時間を比較するベンチマーク。
+
+- fetch: channel.fetch_message() で取得してから edit() / delete() する (従来の実装)
+- partial: channel.get_partial_message() で ID だけを使って edit() / delete() する
+
+discord.py の HTTP 層を差し替えて、リクエストごとに LATENCY 秒待つ疑似サーバーで計測する。
+実行: python benchmarks/discord_mutation_calls.py [回数] [レイテンシ(ms)]
+"""
+import asyncio
+import sys
+import time
+from collections import Counter
+import discord
+
+CHANNEL_ID = 100000000000000001
+MESSAGE_ID = 200000000000000002
+
+def message_payload(content="hello"):
+    return {
+        "id": str(MESSAGE_ID),
+        "channel_id": str(CHANNEL_ID),
+        "type": 0,
+        "content": content,
+        "author": {"id": "300000000000000003", "username": "bridge", "discriminator": "0", "avatar": None},
+        "attachments": [],
+        "embeds": [],
+        "mentions": [],
+        "mention_roles": [],
+        "mention_everyone": False,
+        "pinned": False,
+        "tts": False,
+        "timestamp": "2024-01-01T00:00:00+00:00",
+        "edited_timestamp": None,
+        "flags": 0,
+        "components": [],
+    }
+
+class FakeHTTP:
+    """discord.py の HTTPClient.request の代わりに、呼び出しを記録して固定の応答を返す"""
+
+    def __init__(self, latency):
+        self.latency = latency
+        self.calls = Counter()
+
+    async def request(self, route, **kwargs):
+        self.calls[route.method] += 1
+        await asyncio.sleep(self.latency)
+        if route.method == "DELETE":
+            return None
+        return message_payload(kwargs.get("json", {}).get("content", "hello"))
+
+async def edit_with_fetch(channel):
+    message = await channel.fetch_message(MESSAGE_ID)
+    await message.edit(content="edited")
+
+async def edit_with_partial(channel):
+    await channel.get_partial_message(MESSAGE_ID).edit(content="edited")
+
+async def delete_with_fetch(channel):
+    message = await channel.fetch_message(MESSAGE_ID)
+    await message.delete()
+
+async def delete_with_partial(channel):
+    await channel.get_partial_message(MESSAGE_ID).delete()
+
+async def run(iterations, latency):
+    client = discord.Client(intents=discord.Intents.none())
+    fake = FakeHTTP(latency)
+    client.http.request = fake.request
+    channel = client.get_partial_messageable(CHANNEL_ID)
+
+    print(f"{iterations} operations each, {latency * 1000:.0f}ms per request")
+    print(f"{'case':<20}{'REST calls/op':>15}{'GET/op':>10}{'ms/op':>10}")
+    for name, op in (
+        ("edit (fetch)", edit_with_fetch),
+        ("edit (partial)", edit_with_partial),
+        ("delete (fetch)", delete_with_fetch),
+        ("delete (partial)", delete_with_partial),
+    ):
+        fake.calls.clear()
+        start = time.perf_counter()
+        for _ in range(iterations):
+            await op(channel)
+        elapsed = time.perf_counter() - start
+        total = sum(fake.calls.values())
+        print(
+            f"{name:<20}{total / iterations:>15.1f}{fake.calls['GET'] / iterations:>10.1f}"
+            f"{elapsed / iterations * 1000:>10.1f}"
+        )
+
+if __name__ == "__main__":
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    latency_ms = float(sys.argv[2]) if len(sys.argv) > 2 else 5
+    asyncio.run(run(iterations, latency_ms / 1000))
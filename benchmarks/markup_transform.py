@@ -0,0 +1,119 @@
+"""
+Slack ⇄ Discord の書式変換の1メッセージあたりの処理時間を比較するベンチマーク。
+
+- legacy: 書式ごとに正規表現で全体を置き換えていた従来の実装 (下にそのまま写してある。名前解決は辞書引き)
+- markup: utils.markup の1回走査の変換
+
+実行: python benchmarks/markup_transform.py [回数] [メッセージの長さ(文字)]
+"""
+import os
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from utils.markup import MentionNames, stod_markup, dtos_markup
+
+SLACK_USERS = {f"U{i:08d}": f"user{i}" for i in range(20)}
+SLACK_CHANNELS = {f"C{i:08d}": f"channel{i}" for i in range(5)}
+DISCORD_USERS = {10**17 + i: f"member{i}" for i in range(20)}
+
+SLACK_CHUNKS = [
+    "普通の文章です。", "*太字* ", "~取り消し~ ", "_斜体_ ", "<@U00000003> ", "<#C00000001|channel1> ",
+    "<https://example.com/a?x=1&amp;y=2|リンク> ", "<!here> ", "&gt; 引用\n", "`inline *code*` ",
+    "```\nblock *code* &gt;\n```\n",
+]
+DISCORD_CHUNKS = [
+    "普通の文章です。", "**太字** ", "~~取り消し~~ ", "*斜体* ", f"<@{10**17 + 3}> ", "@here ",
+    "[リンク](https://example.com/a) ", "`inline *code*` ", "```\nblock **code**\n```\n",
+]
+
+# 普通の会話に近い、書式の少ないメッセージ
+PROSE = "今日のミーティングの議事録を共有します。来週までに各自の担当分を確認してください。" * 3 + "\n"
+
+def build(chunks, length):
+    out, i = [], 0
+    while sum(map(len, out)) < length:
+        out.append(chunks[i % len(chunks)])
+        i += 1
+    return "".join(out)
+
+# --- legacy ---
+slack_bold_re = re.compile(r"\*(.+?)\*")
+slack_strike_re = re.compile(r"~(.+?)~")
+discord_bold_re = re.compile(r"_\*(.+?)\*_")
+discord_italic_re = re.compile(r"(?<!\*)\*(.+?)\*(?!\*)")
+discord_strike_re = re.compile(r"~~(.+?)~~")
+slack_link_pattern = re.compile(r"<(https?://[^|>]+)\|([^>]+)>")
+discord_md_pattern = re.compile(r"\[([^\]]+)\]\((https?://[^)]+)\)")
+slack_mention_pattern = re.compile(r"<@(U[A-Z0-9]+)>|<#(C[A-Z0-9]+)(?:|[^>]*)?>")
+
+def legacy_stod(text):
+    text = text.replace("&gt;", ">").replace("<!channel>", "@everyone").replace("<!here>", "@here")
+    names = {**SLACK_USERS, **SLACK_CHANNELS}
+
+    def replacer(match):
+        user_id, channel_id = match.groups()
+        if user_id:
+            return f"*@{names.get(user_id, 'Unknown')}*"
+        return f"*#{names.get(channel_id, 'Unknown')}*"
+
+    text = slack_mention_pattern.sub(replacer, text)
+
+    def link(match):
+        url, label = match.groups()
+        if label.startswith("http://") or label.startswith("https://"):
+            return url
+        return f"[{label}]({url})"
+
+    text = slack_link_pattern.sub(link, text)
+    text = slack_bold_re.sub(r"**\1**", text)
+    return slack_strike_re.sub(r"~~\1~~", text)
+
+def legacy_dtos(text):
+    text = text.replace("@everyone", "<!channel>").replace("@here", "<!here>")
+    for user_id, name in DISCORD_USERS.items():
+        text = text.replace(f"<@{user_id}>", f"**@{name}**")
+    text = discord_md_pattern.sub(r"<\2|\1>", text)
+    text = discord_italic_re.sub(r"_\1_", text)
+    text = discord_bold_re.sub(r"*\1*", text)
+    return discord_strike_re.sub(r"~\1~", text)
+
+# --- markup ---
+def markup_stod(text):
+    refs = stod_markup.refs(text)
+    # 実際には名前は Slack API で引くので、ここでは参照されたIDを集めて辞書から引く
+    names = MentionNames(
+        users={u: SLACK_USERS.get(u) for u in refs.get("user", ())},
+        channels={c: SLACK_CHANNELS.get(c) for c in refs.get("channel", ())},
+    )
+    return stod_markup.transform(text, names)
+
+DTOS_NAMES = MentionNames(users=DISCORD_USERS)
+
+def markup_dtos(text):
+    return dtos_markup.transform(text, DTOS_NAMES)
+
+def measure(func, text, iterations):
+    start = time.perf_counter()
+    for _ in range(iterations):
+        func(text)
+    return (time.perf_counter() - start) / iterations * 1e6
+
+if __name__ == "__main__":
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    length = int(sys.argv[2]) if len(sys.argv) > 2 else 4000
+
+    print(f"{iterations} iterations, ~{length} chars per message")
+    print(f"{'case':<28}{'legacy us/msg':>15}{'markup us/msg':>15}{'ratio':>8}")
+    for name, legacy, markup, chunks in (
+        ("slack -> discord (dense)", legacy_stod, markup_stod, SLACK_CHUNKS),
+        ("slack -> discord (prose)", legacy_stod, markup_stod, [PROSE] + SLACK_CHUNKS[1:4]),
+        ("discord -> slack (dense)", legacy_dtos, markup_dtos, DISCORD_CHUNKS),
+        ("discord -> slack (prose)", legacy_dtos, markup_dtos, [PROSE] + DISCORD_CHUNKS[1:5]),
+    ):
+        text = build(chunks, length)
+        old = measure(legacy, text, iterations)
+        new = measure(markup, text, iterations)
+        print(f"{name:<28}{old:>15.1f}{new:>15.1f}{old / new:>8.2f}")
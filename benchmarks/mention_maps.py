@@ -0,0 +1,45 @@
+"""
+STOD_MAP / DTOS_MAP / DOUBLE_MAP によるメンション置き換えの1メッセージあたりの処理時間を比較するベンチマーク。
+
+- replace: 対応表の組ごとに str.replace する従来の実装
+- multi: utils.markup.MultiReplacer で1回の走査で置き換える
+
+実行: python benchmarks/mention_maps.py [対応表の件数] [メッセージの長さ(文字)] [回数]
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from utils.markup import MultiReplacer
+
+def legacy_replace(text, pairs):
+    for s, d in pairs:
+        text = text.replace(s, d)
+    return text
+
+def measure(func, iterations):
+    start = time.perf_counter()
+    for _ in range(iterations):
+        func()
+    return (time.perf_counter() - start) / iterations * 1e6
+
+if __name__ == "__main__":
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    length = int(sys.argv[2]) if len(sys.argv) > 2 else 2000
+    iterations = int(sys.argv[3]) if len(sys.argv) > 3 else 2000
+
+    pairs = [(f"<@U{i:08d}>", f"<@{10**17 + i}>") for i in range(size)]
+    words = ["会議の件ですが、", "<@U00000007> ", "よろしくお願いします。", f"<@U{size - 1:08d}> ", "@here "]
+    text = ""
+    while len(text) < length:
+        text += words[len(text) % len(words)]
+
+    replacer = MultiReplacer(lambda: pairs)
+    assert replacer(text) == legacy_replace(text, pairs)
+    print(f"{size} mappings, {len(text)} chars per message, {iterations} iterations")
+    print(f"{'replace us/msg':>16}{'multi us/msg':>16}{'ratio':>8}")
+    old = measure(lambda: legacy_replace(text, pairs), iterations)
+    new = measure(lambda: replacer(text), iterations)
+    print(f"{old:>16.1f}{new:>16.1f}{old / new:>8.2f}")
@@ -5,10 +5,14 @@ from discord import app_commands
 from utils.logger import log_event
 from utils.formatter import format_message
 from utils.embed_utils import create_error_embed, create_notification_embed
+import config
 from config import *
 import logging
 from slack_sdk.web.async_client import AsyncWebClient
+from slack_sdk.errors import SlackApiError
 from utils.emoji_mapper import EmojiMapper
+from utils.cache import ExpiringCache, TTLCache
+from utils.markup import MentionNames, MultiReplacer, stod_markup, dtos_markup
 from datetime import datetime, timedelta, time
 import asyncio
 import aiohttp
@@ -17,13 +21,24 @@ import os
 import chardet
 from services.news_service import NewsService
 from services.database_service import *
+from services.directory_service import get_user_profile, get_channel_info, directory_stats
+from services.http_service import get_http_session, attach_http_session
+from services.dispatch_service import (
+    slack_dispatcher, discord_dispatcher, dispatch_stats,
+    PRIORITY_DELETE, PRIORITY_EDIT, PRIORITY_REACTION,
+)
+from services.delivery_service import delivery_scheduler, delivery_key, edit_coalescer, reaction_batcher
+from services.outbox_service import outbox
+from services.routing_service import router
+from services.file_service import (
+    TransferError, iter_download, download_to_spool, upload_chunks, transfer_all, attachment_cache,
+)
 import pytz
 import psutil
 from typing import Literal
 import json
 from datetime import datetime, date
 from xml.etree import ElementTree
-import re
 from typing import Optional, List
 
 SCHEDULE_FILE = "data/schedules.json" # スケジュールデータを保存するファイル
@@ -44,140 +59,75 @@ class LabBot(commands.Bot):
         self.start_time = datetime.now()
 
 # Botインスタンスの作成を修正
-bot = LabBot(command_prefix="!", intents=intents)
+bot = LabBot(command_prefix="!", intents=intents, max_messages=DISCORD_MAX_MESSAGES)
 
 slack_client = AsyncWebClient(token=SLACK_BOT_TOKEN)
 
-# メッセージ転送履歴を追跡するためのキャッシュ
-message_cache = {}
+# メッセージ転送履歴を追跡するためのキャッシュ (重複送信防止)
+message_cache = ExpiringCache(MESSAGE_CACHE_SIZE, MESSAGE_CACHE_TTL)
+
+# 転送 (forward) 元をたどるための、最近見たメッセージのキャッシュ (取得できなかったIDは None)
+reference_cache = TTLCache(REFERENCE_CACHE_SIZE, REFERENCE_CACHE_TTL, REFERENCE_NEGATIVE_TTL)
+reference_stats = {"resolutions": 0, "hops": 0, "fetches": 0, "unavailable": 0, "hop_limit": 0}
 
 async def get_slack_user_name(user_id):
-    user_info = await slack_client.users_info(user=user_id)
-    if not user_info["ok"]:
+    profile = await get_user_profile(slack_client, user_id)
+    if profile is None:
         return None
-    profile = user_info["user"]["profile"]
     return profile.get("display_name") or profile.get("real_name") or "Unnamed"
 
 async def get_slack_channel_name(channel_id):
-    channel_info = await slack_client.conversations_info(channel=channel_id)
-    if not channel_info["ok"]:
+    channel_info = await get_channel_info(slack_client, channel_id)
+    if channel_info is None:
         return None
-    return channel_info["channel"]["name"]
-
-slack_bold_re   = re.compile(r"\*(.+?)\*")
-# slack_italic_re = re.compile(r"_(.+?)_")
-slack_strike_re = re.compile(r"~(.+?)~")
-
-def stod_format(text: str) -> str:
-    text = slack_bold_re.sub(r"**\1**", text)
-    # text = slack_italic_re.sub(r"*\1*", text)
-    text = slack_strike_re.sub(r"~~\1~~", text)
-    return text
-
-discord_bold_re   = re.compile(r"_\*(.+?)\*_")
-discord_italic_re = re.compile(r"(?<!\*)\*(.+?)\*(?!\*)")  # avoid bold conflicts
-discord_strike_re = re.compile(r"~~(.+?)~~")
-
-def dtos_format(text: str) -> str:
-    text = discord_italic_re.sub(r"_\1_", text)    # * to _
-    text = discord_bold_re.sub(r"*\1*", text)      # ** to *
-    text = discord_strike_re.sub(r"~\1~", text)    # ~~ to ~
-    return text
-
-slack_link_pattern = re.compile(r"<(https?://[^|>]+)\|([^>]+)>")
-
-def stod_links(text: str) -> str:
-    def repl(match):
-        url, label = match.groups()
-        if label.startswith("http://") or label.startswith("https://"):
-            return url  # just the raw link
-        return f"[{label}]({url})"
-    return slack_link_pattern.sub(repl, text)
-
-discord_md_pattern = re.compile(r"\[([^\]]+)\]\((https?://[^)]+)\)")
-
-def dtos_links(text: str) -> str:
-    return discord_md_pattern.sub(r"<\2|\1>", text)
-
-async def stod_mentions(text):
-    # special mentions
-    text = text.replace("&gt;", ">")
-    text = text.replace("<!channel>", "@everyone")
-    text = text.replace("<!here>", "@here")
-
-    # mapping
-    for s, d in STOD_MAP:
-        text = text.replace(s, d)
-    for s, d in DOUBLE_MAP:
-        text = text.replace(s, d)
-
-    # Replace <@U12345> with display names
-    user_pattern = re.compile(r"<@(U[A-Z0-9]+)>")
-    channel_pattern = re.compile(r"<#(C[A-Z0-9]+)(?:|[^>]*)?>")
-
-    async def user_replacer(match):
-        user_id = match.group(1)
-        name = await get_slack_user_name(user_id)
-        return f"*@{name}*" if name else "*@Unknown*"
-
-    async def channel_replacer(match):
-        channel_id = match.group(1)
-        name = await get_slack_channel_name(channel_id)
-        return f"*#{name}*" if name else "*#Unknown*"
-
-    async def async_sub(pattern: re.Pattern, repl, text):
-        matches = list(pattern.finditer(text))
-        if not matches:
-            return text
-
-        # Build the new string manually
-        result = []
-        last_end = 0
-        for match in matches:
-            result.append(text[last_end:match.start()])
-            replacement = await repl(match)
-            result.append(replacement)
-            last_end = match.end()
-        result.append(text[last_end:])
-        return ''.join(result)
-
-    text = await async_sub(user_pattern, user_replacer, text)
-    return await async_sub(channel_pattern, channel_replacer, text)
-
-def dtos_mentions(message):
-    text = message.content
-
-    # special mentions
-    text = text.replace("@everyone", "<!channel>")
-    text = text.replace("@here", "<!here>")
-
-    # mapping
-    for d, s in DTOS_MAP:
-        text = text.replace(d, s)
-    for s, d in DOUBLE_MAP:
-        text = text.replace(d, s)
-
-    # User mentions
-    for user in message.mentions:
-        text = text.replace(f"<@{user.id}>", f"**@{user.display_name}**")
-
-    # Channel mentions
-    for channel in message.channel_mentions:
-        text = text.replace(f"<#{channel.id}>", f"**#{channel.name}**")
-
-    # Role mentions
-    for role in message.role_mentions:
-        text = text.replace(f"<@&{role.id}>", f"**@{role.name}**")
-
-    return text
+    return channel_info["name"]
+
+def mention_maps_version():
+    """config の対応表が差し替えられたか・増減したかを安く調べるための値"""
+    return tuple((id(pairs), len(pairs)) for pairs in (config.STOD_MAP, config.DTOS_MAP, config.DOUBLE_MAP))
+
+# config の対応表でメンションを置き換える (対応表を差し替えたり増減させたら次の変換で作り直す。
+# 同じ長さのまま中身を書き換えたときは invalidate を呼ぶ)
+stod_mention_map = MultiReplacer(lambda: [*config.STOD_MAP, *config.DOUBLE_MAP], mention_maps_version)
+dtos_mention_map = MultiReplacer(lambda: [*config.DTOS_MAP, *((d, s) for s, d in config.DOUBLE_MAP)], mention_maps_version)
+
+async def resolve_slack_mentions(refs):
+    """Slack テキストに含まれていたユーザー・チャンネルの名前をまとめて引く (refs は stod_markup.refs で集めたID)"""
+    user_ids = refs.get("user", set())
+    channel_ids = refs.get("channel", set())
+    if not user_ids and not channel_ids:
+        return MentionNames()
+    semaphore = asyncio.Semaphore(MENTION_RESOLVE_CONCURRENCY)
+
+    async def resolve(lookup, key):
+        async with semaphore:
+            try:
+                return key, await lookup(key)
+            except Exception as e:
+                logging.error(f"Failed to resolve Slack mention {key}: {e}")
+                return key, None
+
+    users, channels = await asyncio.gather(
+        asyncio.gather(*(resolve(get_slack_user_name, u) for u in user_ids)),
+        asyncio.gather(*(resolve(get_slack_channel_name, c) for c in channel_ids)),
+    )
+    return MentionNames(users=dict(users), channels=dict(channels))
 
 async def stod_all(text):
-    text = await stod_mentions(text)
-    return stod_format(stod_links(text))
-
-def dtos_all(message):
-    text = dtos_mentions(message)
-    return dtos_format(dtos_links(text))
+    text = stod_mention_map(text)
+    names = await resolve_slack_mentions(stod_markup.refs(text))
+    return stod_markup.transform(text, names)
+
+def dtos_all(message, content=None):
+    """content を指定したら message.content の代わりに変換する (経路の prefix を取り除いた本文など)"""
+    if content is None:
+        content = message.content
+    names = MentionNames(
+        users={user.id: user.display_name for user in message.mentions},
+        channels={channel.id: channel.name for channel in message.channel_mentions},
+        roles={role.id: role.name for role in message.role_mentions},
+    )
+    return dtos_markup.transform(dtos_mention_map(content), names)
 
 # チャンネルチェックデコレータ
 def arxiv_channel_only():
@@ -308,42 +258,123 @@ async def schedule_news():
 
 @bot.event
 async def on_message(message: discord.Message):
+    # 後で転送されたときに取得し直さずに済むよう覚えておく
+    reference_cache.set(message.id, message)
+
     # Botからのメッセージは完全に無視
     if message.author.bot:
         return
-    if NOFW in message.content:
-        logging.info("[NOFW] detected - skipped sending")
-        return
-    
-    # コマンド処理を優先
+
+    # 同じチャンネルのメッセージは受け取った順に転送する (最初の await より前に outbox に積む)
+    if router.routes_from("discord", message.channel.id):
+        if router.forwards("discord", message.channel.id, message.content) or message.reference:
+            outbox.enqueue("discord_message", delivery_key("discord", message.channel.id), message_payload(message), message)
+        else:
+            logging.info("[NOFW] or prefix rule - skipped sending")
+
+    # コマンド処理
     await bot.process_commands(message)
 
-    if message.channel.id == DISCORD_CHANNEL_ID_1 or message.channel.id == DISCORD_CHANNEL_ID_2:
-        channel_id = DTOS[message.channel.id]
-        try:
-            if message.reference and message.type is not discord.MessageType.reply:
-                ref = message.reference
-                while ref:
-                    channel = bot.get_channel(ref.channel_id)
-                    original = await channel.fetch_message(ref.message_id)
-                    if original.type is discord.MessageType.reply:
-                        break
-                    ref = original.reference
-                file_ids = None
-                if original.attachments:
-                    file_ids = await get_file_ids(original.attachments)
-                await send_to_slack(original, message.author, channel_id, file_ids=file_ids, fw_from=original.author, fw_id=message.id)
-            else:
-                file_ids = None
-                if message.attachments:
-                    file_ids = await get_file_ids(message.attachments)
-                await send_to_slack(message, message.author, channel_id, file_ids=file_ids)
+def message_payload(message, **extra):
+    """outbox に記録する Discord メッセージの情報 (再送時はIDから取得し直す)"""
+    return {"channel_id": message.channel.id, "message_id": message.id, **extra}
 
-            logging.info(f"Message and files forwarded from Discord user {message.author.name}")
+async def resolve_message(payload, live):
+    """outbox のペイロードに対応する discord.Message (メッセージかチャンネルが削除済みなら None)"""
+    if live is not None:
+        return live
+    try:
+        # 再送時はキャッシュの準備前やチャンネル削除後のこともあるので、なければ取得する
+        channel = bot.get_channel(payload["channel_id"]) or await bot.fetch_channel(payload["channel_id"])
+        return await channel.fetch_message(payload["message_id"])
+    except discord.NotFound:
+        logging.info(f"Message {payload['message_id']} in channel {payload['channel_id']} no longer exists, dropping event")
+        return None
 
-        except Exception as e:
-            logging.error(f"Failed to send message or files to Slack: {e}")
+@outbox.handler("discord_message")
+async def deliver_discord_message(payload, live):
+    message = await resolve_message(payload, live)
+    if message is None:
+        return
+    # 再送時、転送済みのメッセージは送らない
+    if await get_slack_ts_async(message.id) is not None:
         return
+    await forward_to_slack(message)
+
+async def fetch_referenced_message(ref: discord.MessageReference):
+    """参照先のメッセージ (キャッシュになければ取得する。取得できなければ None)"""
+    if isinstance(ref.resolved, discord.Message):
+        reference_cache.set(ref.message_id, ref.resolved)
+
+    async def loader(message_id):
+        channel = bot.get_channel(ref.channel_id) or bot.get_partial_messageable(ref.channel_id)
+        reference_stats["fetches"] += 1
+        try:
+            return await channel.fetch_message(message_id)
+        except (discord.NotFound, discord.Forbidden):
+            return None
+    return await reference_cache.get(ref.message_id, loader)
+
+async def resolve_forward_origin(message: discord.Message):
+    """
+    転送されたメッセージの元のメッセージを、参照を REFERENCE_MAX_HOPS 回までたどって探す。
+    返信 (reply) か参照を持たないメッセージで止まる。途中の参照先が取得できなければ、
+    そこまでにたどれたメッセージを返す (1つもたどれなければ None)。
+    """
+    reference_stats["resolutions"] += 1
+    original = None
+    ref = message.reference
+    for _ in range(REFERENCE_MAX_HOPS):
+        if ref is None or ref.message_id is None:
+            break
+        target = await fetch_referenced_message(ref)
+        if target is None:
+            reference_stats["unavailable"] += 1
+            break
+        reference_stats["hops"] += 1
+        original = target
+        if target.type is discord.MessageType.reply or target.reference is None:
+            break
+        ref = target.reference
+    else:
+        reference_stats["hop_limit"] += 1
+    return original
+
+async def forward_to_slack(message: discord.Message):
+    """
+    message をチャンネルの経路ごとに Slack へ送る。primary の経路の失敗は再送のため例外を投げ、
+    それ以外の経路 (新しいメッセージだけを転送する) の失敗はログに残すだけにする。
+    """
+    try:
+        original = None
+        if message.reference and message.type is not discord.MessageType.reply:
+            original = await resolve_forward_origin(message)
+            if original is None:
+                logging.warning(f"Referenced message of {message.id} is unavailable, forwarding it as is")
+        source = original if original is not None else message
+        for route in router.routes_from("discord", message.channel.id):
+            content = route.apply(source.content)
+            if content is None:
+                logging.info(f"[NOFW] or prefix rule - skipped sending to {route.target}")
+                continue
+            try:
+                file_ids, failed_files = None, None
+                if source.attachments:
+                    file_ids, failed_files = await get_file_ids(source.attachments, route.target)
+                if original is not None:
+                    await send_to_slack(original, message.author, route.target, file_ids=file_ids, fw_from=original.author, fw_id=message.id, failed_files=failed_files, content=content, record=route.primary)
+                else:
+                    await send_to_slack(message, message.author, route.target, file_ids=file_ids, failed_files=failed_files, content=content, record=route.primary)
+            except Exception as e:
+                if route.primary:
+                    raise
+                logging.error(f"Failed to send message to Slack channel {route.target}: {e}")
+
+        logging.info(f"Message and files forwarded from Discord user {message.author.name}")
+
+    except Exception as e:
+        logging.error(f"Failed to send message or files to Slack: {e}")
+        raise
 
     # 通常のメッセージ処理（スラッシュコマンドではない場合のみ）
     # elif not message.content.startswith('/'):
@@ -356,41 +387,108 @@ async def on_message(message: discord.Message):
     #         await message.channel.send(embed=embed)
 
 @bot.event
-async def on_message_edit(before: discord.Message, after: discord.Message):
+async def on_raw_message_edit(payload: discord.RawMessageUpdateEvent):
+    # キャッシュにない古いメッセージの編集も受け取れるよう raw イベントを使う
+    after = payload.message
     if after.author.bot:
         return
-    if NOFW in after.content:
-        logging.info("[NOFW] detected - skipped editing")
+    # 埋め込み (URL プレビュー) の追加など、本文が編集されていない更新は無視
+    if after.edited_at is None:
         return
-    channel_id = SLACK_CHANNEL_ID_1
-    if after.channel.id == DISCORD_CHANNEL_ID_1 or after.channel.id == DISCORD_CHANNEL_ID_2:
-        if after.channel.id == DISCORD_CHANNEL_ID_2:
-            channel_id = SLACK_CHANNEL_ID_2
-        slack_ts = get_slack_ts(str(after.id))
-        try:
-            # テキストメッセージの転送
-            if slack_ts is not None:
-                await update_to_slack(after, after.author, channel_id, slack_ts)
-                logging.info(f"Message edited from Discord user {after.author.name}")
-        except Exception as e:
-            logging.error(f"Failed to edit message to Slack: {e}")
+    if payload.cached_message is not None and payload.cached_message.content == after.content:
         return
+    if after.id in reference_cache:
+        reference_cache.set(after.id, after)
+    # 編集は対応表に記録した primary の経路にだけ反映する
+    route = router.primary("discord", after.channel.id)
+    if route is None:
+        return
+    if route.apply(after.content) is None:
+        logging.info("[NOFW] or prefix rule - skipped editing")
+        edit_coalescer.cancel(("discord", after.id))
+        return
+    # 連続した編集はまとめて、最後の内容だけを転送する
+    edit_coalescer.submit(("discord", after.id), lambda: outbox.enqueue(
+        "discord_edit", delivery_key("discord", after.channel.id),
+        message_payload(after, slack_channel=route.target), after,
+    ))
+
+@outbox.handler("discord_edit")
+async def deliver_discord_edit(payload, live):
+    after = await resolve_message(payload, live)
+    if after is None:
+        return
+    # 転送したときのチャンネルを使う (記録がなければ経路の転送先)
+    slack_ts, slack_channel = await get_slack_location_async(after.id)
+    try:
+        # テキストメッセージの転送
+        if slack_ts is not None:
+            # 経路が読み込み直されていれば今の規則で判定する
+            route = router.primary("discord", after.channel.id)
+            content = route.apply(after.content) if route else after.content
+            if content is None:
+                logging.info("[NOFW] or prefix rule - skipped editing")
+                return
+            await update_to_slack(after, after.author, slack_channel or payload["slack_channel"], slack_ts, content=content)
+            logging.info(f"Message edited from Discord user {after.author.name}")
+    except Exception as e:
+        logging.error(f"Failed to edit message to Slack: {e}")
+        raise
 
 @bot.event
-async def on_message_delete(message: discord.Message):
-    channel_id = SLACK_CHANNEL_ID_1
-    if message.channel.id == DISCORD_CHANNEL_ID_1 or message.channel.id == DISCORD_CHANNEL_ID_2:
-        if message.channel.id == DISCORD_CHANNEL_ID_2:
-            channel_id = SLACK_CHANNEL_ID_2
-        slack_ts = get_slack_ts(str(message.id))
-        try:
-            # テキストメッセージの転送
-            if slack_ts is not None:
-                await delete_from_slack(message, channel_id, slack_ts)
-                logging.info(f"Message deleted from Discord user {message.author.name}")
-        except Exception as e:
-            logging.error(f"Failed to delete message from Slack: {e}")
+async def on_raw_message_delete(payload: discord.RawMessageDeleteEvent):
+    route = router.primary("discord", payload.channel_id)
+    if route is None:
+        return
+    # 保留中の編集は反映しない
+    edit_coalescer.cancel(("discord", payload.message_id))
+    reference_cache.invalidate(payload.message_id)
+    outbox.enqueue(
+        "discord_delete", delivery_key("discord", payload.channel_id),
+        {"channel_id": payload.channel_id, "message_id": payload.message_id, "slack_channel": route.target},
+    )
+
+@bot.event
+async def on_raw_bulk_message_delete(payload: discord.RawBulkMessageDeleteEvent):
+    route = router.primary("discord", payload.channel_id)
+    if route is None:
         return
+    for message_id in payload.message_ids:
+        edit_coalescer.cancel(("discord", message_id))
+        reference_cache.invalidate(message_id)
+    outbox.enqueue(
+        "discord_bulk_delete", delivery_key("discord", payload.channel_id),
+        {"channel_id": payload.channel_id, "message_ids": sorted(payload.message_ids), "slack_channel": route.target},
+    )
+
+@outbox.handler("discord_bulk_delete")
+async def deliver_discord_bulk_delete(payload, live):
+    # 対応表はまとめて1回で引き、転送済みのものだけ転送したチャンネルから削除する
+    locations = await get_slack_locations_async(payload["message_ids"])
+    results = await asyncio.gather(
+        *(
+            delete_from_slack(discord_id, slack_channel or payload["slack_channel"], slack_ts)
+            for discord_id, (slack_ts, slack_channel) in locations.items()
+        ),
+        return_exceptions=True,
+    )
+    errors = [result for result in results if isinstance(result, Exception)]
+    logging.info(f"Bulk delete from Discord: {len(locations) - len(errors)}/{len(payload['message_ids'])} messages deleted from Slack")
+    if errors:
+        # 削除できたものは対応表から消えているので、再送時は残りだけが対象になる
+        raise errors[0]
+
+@outbox.handler("discord_delete")
+async def deliver_discord_delete(payload, live):
+    slack_ts, slack_channel = await get_slack_location_async(payload["message_id"])
+    try:
+        # テキストメッセージの転送
+        if slack_ts is not None:
+            await delete_from_slack(payload["message_id"], slack_channel or payload["slack_channel"], slack_ts)
+            logging.info(f"Message {payload['message_id']} deleted from Discord")
+    except Exception as e:
+        logging.error(f"Failed to delete message from Slack: {e}")
+        raise
 
 @bot.tree.command(name="notify")
 async def notify(interaction: discord.Interaction, user: discord.Member, *, content: str):
@@ -516,6 +614,40 @@ async def log_delete(interaction: discord.Interaction):
         )
         logging.error(f"ログ削除エラー: {e}")
 
+@bot.tree.command(
+    name="dead_letters",
+    description="転送に失敗し続けたイベントを表示します（管理者のみ）"
+)
+@is_admin()
+@log_channel_only()
+async def dead_letters(interaction: discord.Interaction):
+    """再送の上限に達したイベント (dead_letters テーブル) の最新10件を表示します（管理者のみ）"""
+    try:
+        entries = await list_dead_letters_async(10)
+        if not entries:
+            await interaction.response.send_message("dead letter はありません。", ephemeral=True)
+            return
+
+        embed = discord.Embed(
+            title="📮 Dead letters",
+            description=f"最新 {len(entries)} 件",
+            color=discord.Color.orange(),
+            timestamp=datetime.now()
+        )
+        for entry in entries:
+            embed.add_field(
+                name=f"#{entry['id']} {entry['kind']} ({entry['key']})",
+                value=f"{entry['attempts']}回失敗 / {entry['failed_at']}\n```{(entry['last_error'] or '')[:300]}```",
+                inline=False
+            )
+        await interaction.response.send_message(embed=embed, ephemeral=True)
+    except Exception as e:
+        logging.error(f"dead letter 表示エラー: {e}")
+        await interaction.response.send_message(
+            "dead letter の取得中にエラーが発生しました。",
+            ephemeral=True
+        )
+
 @bot.tree.command(
     name="news",
     description="最新のテックニュースを取得します"
@@ -611,46 +743,46 @@ async def news(interaction: discord.Interaction, default: bool = False):
 async def arxiv_search(interaction: discord.Interaction, query: str):
     try:
         url = f'http://export.arxiv.org/api/query?search_query=all:{query}&start=0&max_results=5'
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url) as response:
-                if response.status == 200:
-                    content = await response.text()
-                    root = ElementTree.fromstring(content)
-                    entries = root.findall('{http://www.w3.org/2005/Atom}entry')
-
-                    if not entries:
-                        await interaction.response.send_message("論文が見つかりませんでした。", ephemeral=True)
-                        return
-
-                    embed = discord.Embed(
-                        title=f"検索結果 (キーワード: {query})",
-                        description="IDをコピーするには、IDの行を選択してコピーしてください。",
-                        color=discord.Color.blue()
-                    )
+        session = get_http_session()
+        async with session.get(url) as response:
+            if response.status == 200:
+                content = await response.text()
+                root = ElementTree.fromstring(content)
+                entries = root.findall('{http://www.w3.org/2005/Atom}entry')
+
+                if not entries:
+                    await interaction.response.send_message("論文が見つかりませんでした。", ephemeral=True)
+                    return
+
+                embed = discord.Embed(
+                    title=f"検索結果 (キーワード: {query})",
+                    description="IDをコピーするには、IDの行を選択してコピーしてください。",
+                    color=discord.Color.blue()
+                )
                     
-                    for entry in entries:
-                        title = entry.find('{http://www.w3.org/2005/Atom}title').text
-                        link = entry.find('{http://www.w3.org/2005/Atom}id').text
-                        paper_id = link.split('/')[-1]
+                for entry in entries:
+                    title = entry.find('{http://www.w3.org/2005/Atom}title').text
+                    link = entry.find('{http://www.w3.org/2005/Atom}id').text
+                    paper_id = link.split('/')[-1]
                         
-                        # タイトルとキーワードを組み合わせて表示
-                        keywords = [kw.strip() for kw in query.split(',')]
-                        keyword_text = " | ".join([f"🔑={kw}" for kw in keywords])
+                    # タイトルとキーワードを組み合わせて表示
+                    keywords = [kw.strip() for kw in query.split(',')]
+                    keyword_text = " | ".join([f"🔑={kw}" for kw in keywords])
                         
-                        embed.add_field(
-                            name=f"📄 論文情報",
-                            value=(
-                                f"**タイトル**: {title}\n"
-                                f"**キーワード**: {keyword_text}\n"
-                                f"**ID**: `{paper_id}`\n"
-                                f"**リンク**: [arXiv]({link})"
-                            ),
-                            inline=False
-                        )
+                    embed.add_field(
+                        name=f"📄 論文情報",
+                        value=(
+                            f"**タイトル**: {title}\n"
+                            f"**キーワード**: {keyword_text}\n"
+                            f"**ID**: `{paper_id}`\n"
+                            f"**リンク**: [arXiv]({link})"
+                        ),
+                        inline=False
+                    )
                     
-                    await interaction.response.send_message(embed=embed, ephemeral=True)
-                else:
-                    await interaction.response.send_message("APIの呼び出しに失敗しました。", ephemeral=True)
+                await interaction.response.send_message(embed=embed, ephemeral=True)
+            else:
+                await interaction.response.send_message("APIの呼び出しに失敗しました。", ephemeral=True)
     except Exception as e:
         logging.error(f"arXiv検索エラー: {e}")
         await interaction.response.send_message("検索中にエラーが発生しました。", ephemeral=True)
@@ -674,32 +806,32 @@ async def arxiv_save(interaction: discord.Interaction, paper_id: str):
             return
         
         url = f'http://export.arxiv.org/api/query?id_list={paper_id}'
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url) as response:
-                if response.status == 200:
-                    content = await response.text()
-                    root = ElementTree.fromstring(content)
-                    entry = root.find('{http://www.w3.org/2005/Atom}entry')
+        session = get_http_session()
+        async with session.get(url) as response:
+            if response.status == 200:
+                content = await response.text()
+                root = ElementTree.fromstring(content)
+                entry = root.find('{http://www.w3.org/2005/Atom}entry')
                     
-                    if entry:
-                        title = entry.find('{http://www.w3.org/2005/Atom}title').text
-                        # 新しい論文を追加
-                        favorites[user_id].append({
-                            'id': paper_id,
-                            'title': title,
-                            'saved_at': datetime.now().isoformat()
-                        })
-                        # 変更を保存
-                        save_favorites(favorites)
+                if entry:
+                    title = entry.find('{http://www.w3.org/2005/Atom}title').text
+                    # 新しい論文を追加
+                    favorites[user_id].append({
+                        'id': paper_id,
+                        'title': title,
+                        'saved_at': datetime.now().isoformat()
+                    })
+                    # 変更を保存
+                    save_favorites(favorites)
                         
-                        await interaction.response.send_message(
-                            f"論文を保存しました:\nID: {paper_id}\nTitle: {title}",
-                            ephemeral=True
-                        )
-                    else:
-                        await interaction.response.send_message("論文が見つかりませんでした。", ephemeral=True)
+                    await interaction.response.send_message(
+                        f"論文を保存しました:\nID: {paper_id}\nTitle: {title}",
+                        ephemeral=True
+                    )
                 else:
-                    await interaction.response.send_message("APIの呼び出しに失敗しました。", ephemeral=True)
+                    await interaction.response.send_message("論文が見つかりませんでした。", ephemeral=True)
+            else:
+                await interaction.response.send_message("APIの呼び出しに失敗しました。", ephemeral=True)
     except Exception as e:
         logging.error(f"論文保存エラー: {e}")
         await interaction.response.send_message("保存中にエラーが発生しました。", ephemeral=True)
@@ -804,6 +936,7 @@ async def help(interaction: discord.Interaction):
                 "```\n"
                 "/log - 最新のログを表示\n"
                 "/log_delete - ログファイルの内容を削除\n"
+                "/dead_letters - 転送に失敗し続けたイベントを表示\n"
                 "```\n"
                 f"※ これらのコマンドは <#{DISCORD_LOG_CHANNEL_ID}> チャンネルでのみ使用可能です。"
             ),
@@ -845,7 +978,7 @@ async def help(interaction: discord.Interaction):
                 f"• `/news`: <#{DISCORD_NEWS_CHANNEL_ID}> のみ\n"
                 f"• `/arxiv_*`: <#{DISCORD_ARXIV_CHANNEL_ID}> のみ\n"
                 f"• `/log`, `/log_delete`: <#{DISCORD_LOG_CHANNEL_ID}> のみ\n"
-                f"• Slack連携: <#{DISCORD_CHANNEL_ID_1}> のみ"
+                f"• Slack連携: {' '.join(f'<#{c}>' for c in router.table.channels('discord')) or 'なし'}"
             ),
             inline=False
         )
@@ -928,6 +1061,142 @@ async def stats(interaction: discord.Interaction):
             inline=True
         )
 
+        # 転送済みメッセージの重複チェック用キャッシュ
+        dedup = message_cache.stats()
+        embed.add_field(
+            name="♻️ 重複送信チェック",
+            value=(
+                f"保持: {dedup['size']} / {dedup['maxsize']}件\n"
+                f"重複スキップ: {dedup['duplicates']}件 / 期限切れ: {dedup['expired']}件 / 上限超過: {dedup['evicted']}件"
+            ),
+            inline=False
+        )
+
+        # Slack ユーザー / チャンネル名キャッシュ
+        directory = directory_stats()
+        embed.add_field(
+            name="🗂️ Slack名前キャッシュ",
+            value="\n".join(
+                f"{label}: {s['size']}件 (hit {s['hits']} / miss {s['misses']}, {s['hit_ratio']:.0%})"
+                for label, s in (("ユーザー", directory["users"]), ("チャンネル", directory["channels"]))
+            ),
+            inline=False
+        )
+
+        # メッセージ対応表 (slack_ts ⇄ discord_id)
+        mapping = mapping_stats()
+        compaction = mapping["compaction"]
+        embed.add_field(
+            name="🔗 メッセージ対応表",
+            value=(
+                f"キャッシュ: {mapping['cache']['size']}件 "
+                f"(hit {mapping['cache']['hits']} / miss {mapping['cache']['misses']}, "
+                f"{mapping['cache']['hit_ratio']:.0%})\n"
+                f"未コミット: {mapping['buffer']['pending']}件 / コミット回数: {mapping['buffer']['flushes']}\n"
+                + (
+                    f"前回の整理: {compaction['rows']}件削除, {compaction['bytes'] / 1024:.1f}KB解放"
+                    if compaction else "前回の整理: 未実行"
+                )
+            ),
+            inline=False
+        )
+
+        # 送信キュー (レート制限)
+        dispatch = dispatch_stats()
+        embed.add_field(
+            name="📤 送信キュー",
+            value="\n".join(
+                f"{label}: 待ち {d['queued']}件 / 送信 {d['sent']}件 / 失敗 {d['failed']}件 / "
+                + (f"429 {d['rate_limited']}回 / " if "rate_limited" in d else "")
+                + f"平均待ち {d['avg_wait']:.2f}秒 (最大 {d['max_wait']:.1f}秒)"
+                for label, d in (("Slack", dispatch["slack"]), ("Discord", dispatch["discord"]))
+            ),
+            inline=False
+        )
+
+        # 受信イベントの outbox (再送待ち / dead letter)
+        pending = await outbox.stats()
+        embed.add_field(
+            name="📮 Outbox",
+            value=(
+                f"未完了: {pending['pending']}件 / dead letter: {pending['dead']}件\n"
+                f"転送: {pending['delivered']}件 / 再送予定: {pending['retried']}回"
+            ),
+            inline=False
+        )
+
+        # 転送元メッセージの解決
+        references = reference_cache.stats()
+        embed.add_field(
+            name="↪️ 転送元の解決",
+            value=(
+                f"解決: {reference_stats['resolutions']}件 / たどった参照: {reference_stats['hops']}回 / "
+                f"REST取得: {reference_stats['fetches']}回 (キャッシュで省略: {references['hits']}回)\n"
+                f"取得できない参照: {reference_stats['unavailable']}件 / 上限到達: {reference_stats['hop_limit']}件 / "
+                f"キャッシュ: {references['size']} / {references['maxsize']}件"
+            ),
+            inline=False
+        )
+
+        # 連続した編集のまとめ
+        edits = edit_coalescer.stats()
+        embed.add_field(
+            name="✏️ 編集のまとめ",
+            value=(
+                f"受信: {edits['received']}件 / 反映: {edits['applied']}件 / "
+                f"まとめた: {edits['coalesced']}件 / 削除で破棄: {edits['cancelled']}件 / 保留中: {edits['pending']}件"
+            ),
+            inline=False
+        )
+
+        # Slack のリアクションのまとめ
+        reactions = reaction_batcher.stats()
+        embed.add_field(
+            name="😀 リアクションのまとめ (Slack → Discord)",
+            value=(
+                f"受信: {reactions['received']}件 / まとめた回数: {reactions['batches']}回 / "
+                f"打ち消し・重複: {reactions['collapsed']}件 / 保留中: {reactions['pending']}件"
+            ),
+            inline=False
+        )
+
+        # 転送経路
+        routes = router.stats()
+        embed.add_field(
+            name="🧭 転送経路",
+            value=(
+                f"経路: {routes['routes']}件 ({routes['source']}) / "
+                f"読み込み: {routes['reloads']}回 / 失敗: {routes['failures']}回"
+            ),
+            inline=False
+        )
+
+        # 送信元チャンネルごとの配信キュー
+        delivery = delivery_scheduler.stats(top=10).items()
+        embed.add_field(
+            name="🚚 配信キュー (送信元チャンネル別)",
+            value="\n".join(
+                f"{key}: 待ち {d['depth']}件 / 処理 {d['processed']}件 / "
+                f"平均待ち {d['avg_wait']:.2f}秒 (最大 {d['max_wait']:.1f}秒)"
+                for key, d in delivery
+            ) or "まだありません",
+            inline=False
+        )
+
+        # 添付ファイルキャッシュ (SHA-256)
+        attachments = attachment_cache.stats()
+        embed.add_field(
+            name="📎 添付ファイルキャッシュ",
+            value=(
+                f"保持: {attachments['files']}件 / {attachments['bytes'] / 1024 / 1024:.1f}MB "
+                f"(上限 {attachments['max_bytes'] / 1024 / 1024:.0f}MB)\n"
+                f"ダウンロード省略: {attachments['download_skips']}件 / "
+                f"アップロード省略: {attachments['upload_skips']}件 / "
+                f"節約: {attachments['bytes_saved'] / 1024 / 1024:.1f}MB"
+            ),
+            inline=False
+        )
+
         await interaction.response.send_message(embed=embed, ephemeral=True)
 
     except Exception as e:
@@ -1067,51 +1336,85 @@ async def schedule(
         #         else:
 
 async def get_file_objs(files):
+    """
+    Slackの添付ファイルを並列にダウンロードする。
+
+    Returns:
+        ([(filename, file_obj, キャッシュのキー)], 転送できなかったファイル名のリスト)
+    """
     logging.info(f"Downloading files from Slack...")
-    
-    file_objs = []
-    for file in files:
-        try:
-            # ファイルサイズと種類のチェック
-            file_size = file.get("size", 0)
-            if file_size > MAX_FILE_SIZE:
-                logging.error(f"ファイルサイズが大きすぎます: {file_size} bytes")
-                continue
-            # ファイルURLと認証情報を取得
-            file_url = file["url_private_download"]
-            headers = {"Authorization": f"Bearer {SLACK_USER_TOKEN}"}
-            # ファイルをダウンロード
-            file_content = await file_download(file_url, headers=headers)
-            if file_content is None:
-                continue
-            file_objs.append((file["name"], file_content))
 
-        except Exception as e:
-            logging.error(f"File download error: {e}")
+    # ファイルサイズと種類のチェック
+    targets = []
+    failed_names = []
+    for file in files:
+        file_size = file.get("size", 0)
+        if file_size > MAX_FILE_SIZE:
+            logging.error(f"ファイルサイズが大きすぎます: {file_size} bytes")
+            failed_names.append(file.get("name", "unknown"))
             continue
-    
-    return file_objs
-    
-
-async def send_to_discord(message_text, user_name: str, channel_name: str, channel_id, slack_ts, file_objs=None):
+        targets.append(file)
+
+    async def download(file):
+        # ファイルURLと認証情報を取得
+        file_url = file["url_private_download"]
+        headers = {"Authorization": f"Bearer {SLACK_USER_TOKEN}"}
+        source_key = f"slack:{file['id']}"
+        if not attachment_cache.enabled:
+            # ファイルをダウンロード (大きいファイルはメモリではなく一時ファイルに書き出す)
+            spool = await download_to_spool(file_url, headers=headers)
+            return file["name"], spool, None
+
+        # 同じファイルはダウンロードせずキャッシュから読む
+        sha = attachment_cache.lookup(source_key)
+        if sha is None:
+            sha = await attachment_cache.fetch(source_key, iter_download(file_url, headers=headers))
+        return file["name"], attachment_cache.open_blob(sha), source_key
+
+    file_objs, failed = await transfer_all(targets, download, lambda file: file.get("size", 0))
+    for file, error in failed:
+        logging.error(f"File download error ({file.get('name')}): {error}")
+        failed_names.append(file.get("name", "unknown"))
+    return file_objs, failed_names
+
+def failed_files_note(failed_files):
+    if not failed_files:
+        return ""
+    return f"\n_(転送できなかったファイル: {', '.join(failed_files)})_"
+
+async def send_to_discord(message_text, user_name: str, channel_name: str, channel_id, slack_ts, file_objs=None, slack_channel=None, failed_files=None, record=True):
     logging.info(f"Sending to Discord from {user_name} in {channel_name}")
     channel = bot.get_channel(channel_id)
 
-    if channel:
-        content = f"**{user_name}**"
-        if not channel_name.startswith("42_"):
-            content += f' - *#{channel_name.replace('_', '\\_')}*'
-        content += f":\n{await stod_all(message_text)}"
-        if file_objs:
-            files = [discord.File(io.BytesIO(file_content), filename=filename) for filename, file_content in file_objs]
-            message = await channel.send(content, files=files)
-            logging.info("Files sent: " + ", ".join(file[0] for file in file_objs))
+    try:
+        if channel:
+            content = f"**{user_name}**"
+            if not channel_name.startswith("42_"):
+                content += f' - *#{channel_name.replace('_', '\\_')}*'
+            content += f":\n{await stod_all(message_text)}"
+            content += failed_files_note(failed_files)
+            if file_objs:
+                def send():
+                    # 再送でも先頭から読めるよう、毎回 discord.File を作り直す
+                    files = []
+                    for filename, file_obj, _ in file_objs:
+                        file_obj.seek(0)
+                        files.append(discord.File(file_obj, filename=filename))
+                    return channel.send(content, files=files)
+                message = await discord_dispatcher.submit(channel_id, send)
+                logging.info("Files sent: " + ", ".join(file[0] for file in file_objs))
+            else:
+                message = await discord_dispatcher.submit(channel_id, lambda: channel.send(content))
+            logging.info("Message sent to Discord successfully")
+            # primary 以外の経路への転送は対応表に記録しない
+            if record:
+                await save_mapping_async(slack_ts=slack_ts, discord_id=message.id, slack_channel=slack_channel, discord_channel=channel_id)
         else:
-            message = await channel.send(content)
-        logging.info("Message sent to Discord successfully")
-        save_mapping(slack_ts=slack_ts, discord_id=message.id)
-    else:
-        logging.error("Discord通知チャンネルが見つかりません")
+            logging.error("Discord通知チャンネルが見つかりません")
+    finally:
+        # get_file_objs の一時ファイルを解放
+        for _, file_obj, _ in file_objs or []:
+            file_obj.close()
 
 async def edit_at_discord(message_text, user_name, channel_name, channel_id, discord_id):
 
@@ -1120,18 +1423,21 @@ async def edit_at_discord(message_text, user_name, channel_name, channel_id, dis
 
     if channel:
         try:
-            message = await channel.fetch_message(discord_id)
             content = f"**{user_name}**"
             if not channel_name.startswith("42_"):
                 content += f' - *#{channel_name.replace('_', '\\_')}*'
             content += f":\n{await stod_all(message_text)}"
-            await message.edit(content=content)
+
+            # IDだけで編集する (fetch_message の GET を省く。存在しなければ PATCH が NotFound になる)
+            message = channel.get_partial_message(int(discord_id))
+            await discord_dispatcher.submit(channel_id, lambda: message.edit(content=content), PRIORITY_EDIT)
         except discord.NotFound:
             logging.error(f"Error: Message with ID {discord_id} not found.")
         except discord.Forbidden:
             logging.error("Error: The bot does not have permissions to edit this message.")
         except Exception as e:
             logging.error(f"An unexpected error occurred: {e}")
+            raise
         else:
             logging.info("Message edited at Discord successfully")
     else:
@@ -1143,108 +1449,142 @@ async def delete_from_discord(channel_name, channel_id, discord_id):
 
     if channel:
         try:
-            message = await channel.fetch_message(discord_id)
-            await message.delete()
+            # IDだけで削除する (fetch_message の GET を省く)
+            message = channel.get_partial_message(int(discord_id))
+            await discord_dispatcher.submit(channel_id, message.delete, PRIORITY_DELETE)
         except discord.NotFound:
             logging.error(f"Error: Message with ID {discord_id} not found.")
         except discord.Forbidden:
             logging.error("Error: The bot does not have permissions to delete this message.")
         except Exception as e:
             logging.error(f"An unexpected error occurred: {e}")
+            raise
         else:
             logging.info("Message deleted from Discord successfully")
     else:
         logging.error("Discord通知チャンネルが見つかりません")
 
-async def send_to_slack(message, author, channel_id, file_ids=None, fw_from=None, fw_id=None):
+async def add_reaction_at_discord(channel_id, discord_id, emoji):
+    """Bot としてリアクションを付ける (メッセージは取得しない)"""
+    channel = bot.get_channel(channel_id)
+    if channel is None:
+        logging.error("Discord通知チャンネルが見つかりません")
+        return
+    message = channel.get_partial_message(int(discord_id))
+    try:
+        await discord_dispatcher.submit(channel_id, lambda: message.add_reaction(emoji), PRIORITY_REACTION)
+    except discord.NotFound:
+        logging.error(f"Error: Message with ID {discord_id} not found.")
+    except discord.HTTPException as e:
+        # 10014: Unknown Emoji (Discord で使えない絵文字) は再送しても同じなので諦める
+        if e.code != 10014:
+            raise
+        logging.warning(f"Discord does not accept reaction {emoji}")
+
+async def remove_reaction_at_discord(channel_id, discord_id, emoji):
+    """Bot が付けたリアクションを外す"""
+    channel = bot.get_channel(channel_id)
+    if channel is None:
+        logging.error("Discord通知チャンネルが見つかりません")
+        return
+    message = channel.get_partial_message(int(discord_id))
+    try:
+        await discord_dispatcher.submit(channel_id, lambda: message.remove_reaction(emoji, bot.user), PRIORITY_REACTION)
+    except discord.NotFound:
+        logging.error(f"Error: Message with ID {discord_id} not found.")
+    except discord.HTTPException as e:
+        if e.code != 10014:
+            raise
+        logging.warning(f"Discord does not accept reaction {emoji}")
+
+async def send_to_slack(message, author, channel_id, file_ids=None, fw_from=None, fw_id=None, failed_files=None, content=None, record=True):
     """
     メッセージの重複送信を防ぐためのキャッシュチェック付きSlack送信
+    (record=False なら対応表に記録しない。primary 以外の経路への転送)
     """
     message_id = str(message.id) if not fw_from else str(fw_id)
-    if message_id in message_cache:
+    dedup_key = message_id if record else f"{message_id}:{channel_id}"
+    if not message_cache.add(dedup_key):
         return
 
-    message_cache[message_id] = datetime.now()
-
     try:
-        if file_ids:
+        upload_ids = [f for f in file_ids or [] if "id" in f]
+        permalinks = [f["permalink"] for f in file_ids or [] if "permalink" in f]
+        if upload_ids:
             # Step 3: complete upload and share in channel
             if fw_from:
                 comment = f"File shared by *@{author.display_name}* [_forwarded from *@{fw_from.display_name}*_]"
             else:
                 comment = f"File shared by *@{author.display_name}*"
-            await slack_client.files_completeUploadExternal(
-                files=file_ids,
+            await slack_dispatcher.submit(channel_id, lambda: slack_client.files_completeUploadExternal(
+                files=upload_ids,
                 channel_id=channel_id,
                 initial_comment=comment
-            )
+            ))
         
         text = ''
         if fw_from:
             text = f"[_*@{fw_from.display_name}* から転送_]\n"
-        text += dtos_all(message)
-        response = await slack_client.chat_postMessage(
+        text += dtos_all(message, content)
+        text += failed_files_note(failed_files)
+        if permalinks:
+            # 転送済みのファイルは再アップロードせずリンクで共有
+            text += "\n" + "\n".join(permalinks)
+        response = await slack_dispatcher.submit(channel_id, lambda: slack_client.chat_postMessage(
             channel=channel_id,
             username=author.display_name,
             text=text,
-        )
+        ))
 
         if response["ok"]:
             slack_ts = response["ts"]
-            save_mapping(slack_ts=slack_ts, discord_id=message_id)
+            if record:
+                await save_mapping_async(slack_ts=slack_ts, discord_id=message_id, slack_channel=channel_id, discord_channel=message.channel.id)
 
             # Slackのタイムスタンプをキャッシュに保存
-            message_cache[message_id] = slack_ts
-
-            # 古いキャッシュエントリの削除
-            current_time = datetime.now()
-            message_cache.update({k: v for k, v in message_cache.items() 
-                                if current_time - datetime.fromtimestamp(float(v)) < timedelta(minutes=5)})
+            message_cache[dedup_key] = slack_ts
 
     except Exception as e:
+        # 再送できるよう、重複チェックから外す
+        message_cache.pop(dedup_key, None)
         logging.error(f"Error sending message to Slack: {e}")
+        raise
 
-async def update_to_slack(message, user, channel_id, slack_ts):
+async def update_to_slack(message, user, channel_id, slack_ts, content=None):
     """
     メッセージの重複送信を防ぐためのキャッシュチェック付きSlack送信
     """
 
     try:
-        response = await slack_client.chat_update(
+        text = dtos_all(message, content)
+        response = await slack_dispatcher.submit(channel_id, lambda: slack_client.chat_update(
             channel=channel_id,
             ts=slack_ts,
-            text=dtos_all(message),
-        )
+            text=text,
+        ), PRIORITY_EDIT)
         
     except Exception as e:
         logging.error(f"Error editing message to Slack: {e}")
+        raise
 
-async def delete_from_slack(message, channel_id, slack_ts):
+async def delete_from_slack(discord_id, channel_id, slack_ts):
     """
     メッセージの重複送信を防ぐためのキャッシュチェック付きSlack送信
     """
     try:
-        response = await slack_client.chat_delete(channel=channel_id, ts=slack_ts)
-        delete_mapping_by_discord(str(message.id))
+        response = await slack_dispatcher.submit(
+            channel_id, lambda: slack_client.chat_delete(channel=channel_id, ts=slack_ts), PRIORITY_DELETE
+        )
+        await delete_mapping_by_discord_async(discord_id)
+    except SlackApiError as e:
+        if e.response.get("error") != "message_not_found":
+            logging.error(f"Error deleting message from Slack: {e}")
+            raise
+        # 削除済み (再送時など)
+        await delete_mapping_by_discord_async(discord_id)
     except Exception as e:
         logging.error(f"Error deleting message from Slack: {e}")
-
-async def file_download(file_url, headers=None):
-    """ファイルをダウンロードして転送する共通関数"""
-    try:
-        async with aiohttp.ClientSession(headers=headers) as session:
-            async with session.get(file_url) as resp:
-                if resp.status == 200:
-                    file_content = await resp.read()
-                    file_size = len(file_content)
-                    if file_size > MAX_FILE_SIZE:
-                        logging.error(f"ファイルサイズが大きすぎます: {file_size} bytes")
-                        return
-                    return file_content
-                else:
-                    logging.error(f"Download failed with status {resp.status}")
-    except Exception as e:
-        logging.error(f"ファイルダウンロードエラー: {e}")
+        raise
 
 def get_filename(file: discord.Attachment) -> str:
     if not file.title:
@@ -1254,130 +1594,155 @@ def get_filename(file: discord.Attachment) -> str:
         return file.title + ext
     return file.title
 
-async def get_file_ids(files: List[discord.Attachment]):
-    logging.info("Uploading files to Slack...")
-    file_ids = []
-    for file in files:
-        try:
-            # Step 0: download from URL
-            result = await file_download(file.url)
-            if result is None:
-                return
-
-            # Step 1: get upload URL
-            resp1 = await slack_client.files_getUploadURLExternal(
-                filename=get_filename(file),
-                length=len(result),
-            )
-            upload_url = resp1.get("upload_url")
-            file_id = resp1.get("file_id")
+async def get_slack_permalink(file_id):
+    """アップロード済みのSlackファイルのパーマリンク (削除済みなどで取得できなければ None)"""
+    if not file_id:
+        return None
+    try:
+        resp = await slack_client.files_info(file=file_id)
+        return resp["file"].get("permalink")
+    except Exception as e:
+        logging.info(f"Cached Slack file {file_id} is not available: {e}")
+        return None
 
-            if not upload_url or not file_id:
-                logging.error(f"Failed to get upload URL: {resp1}")
-                continue
+async def get_file_ids(files: List[discord.Attachment], channel_id):
+    """
+    Discordの添付ファイルを並列にSlackへアップロードする (channel_id に共有済みのファイルはリンクで共有する)。
 
-            # Step 2: upload file data
-            async with aiohttp.ClientSession() as session:
-                http_resp = await session.post(upload_url, data=result, headers={"Content-Type": "application/octet-stream"})
-                if http_resp.status != 200:
-                    logging.error(f"Upload failed with status {http_resp.status}")
-                    continue
-                
-            file_ids.append({"id": file_id})
+    Returns:
+        ([{"id": file_id} または {"permalink": 転送済みファイルのURL}], 転送できなかったファイル名のリスト)
+    """
+    logging.info("Uploading files to Slack...")
 
-        except Exception as e:
-            logging.error(f"Error uploading file to Slack: {e}")
+    # Step 0: check size (Discord tells us the size up front)
+    targets = []
+    failed_names = []
+    for file in files:
+        if file.size > MAX_FILE_SIZE:
+            logging.error(f"ファイルサイズが大きすぎます: {file.size} bytes")
+            failed_names.append(get_filename(file))
             continue
-    
-    return file_ids
-
-
-async def send_file_to_slack(author, attachment, channel_id, fw_from=None, fw_id=None):
-    """Discordのファイルを Slack に転送"""
-    try:
-        filename = attachment.filename
-        # Step 0: download from URL
-        result = await file_download(attachment.url)
-        if result is None:
-            return
+        targets.append(file)
+
+    async def upload(file):
+        # Step 0: hash the file into the local cache first (skipped if this attachment was cached before),
+        # then reuse a file with the same content already shared to this channel.
+        # A re-post gets a new attachment ID, so it is downloaded again, but the upload is skipped.
+        source_key = f"discord:{file.id}"
+        sha = None
+        if attachment_cache.enabled:
+            sha = attachment_cache.lookup(source_key)
+            if sha is None:
+                sha = await attachment_cache.fetch(source_key, iter_download(file.url, max_size=file.size))
+            permalink = await get_slack_permalink(attachment_cache.get_destination(sha, "slack", channel_id))
+            if permalink:
+                return {"permalink": permalink}
 
         # Step 1: get upload URL
         resp1 = await slack_client.files_getUploadURLExternal(
-            filename=filename,
-            length=len(result),
+            filename=get_filename(file),
+            length=file.size,
         )
         upload_url = resp1.get("upload_url")
         file_id = resp1.get("file_id")
 
         if not upload_url or not file_id:
-            logging.error(f"Failed to get upload URL: {resp1}")
-            return
+            raise TransferError(f"Failed to get upload URL: {resp1}")
 
-        # Step 2: upload file data
-        async with aiohttp.ClientSession() as session:
-            http_resp = await session.post(upload_url, data=result, headers={"Content-Type": "application/octet-stream"})
-            if http_resp.status != 200:
-                logging.error(f"Upload failed with status {http_resp.status}")
-                return
-
-        # Step 3: complete upload and share in channel
-        if fw_from:
-            comment = f"*{author.display_name}* [_*@{fw_from.display_name}* から転送_]:"
+        # Step 2: stream file data (from the cache, or straight from Discord when the cache is disabled)
+        if sha is not None:
+            chunks = attachment_cache.iter_blob(sha)
         else:
-            comment = f"@{author.display_name}:*"
-        resp3 = await slack_client.files_completeUploadExternal(
-            files=[{"id": file_id}],
-            channel_id=channel_id,
-            initial_comment=comment
-        )
-        if resp3.get("ok"):
-            logging.info(f"ファイル転送成功: {filename}")
-        else:
-            logging.error(f"Complete upload failed: {resp3}")
-
-    except Exception as e:
-        logging.error(f"Slackへのファイル転送エラー: {e}")
+            chunks = iter_download(file.url, max_size=file.size)
+        await upload_chunks(chunks, upload_url, file.size)
+        attachment_cache.set_destination(source_key, "slack", channel_id, file_id)
+        return {"id": file_id}
+
+    file_ids, failed = await transfer_all(targets, upload, lambda file: file.size)
+    for file, error in failed:
+        logging.error(f"Error uploading file to Slack ({get_filename(file)}): {error}")
+        failed_names.append(get_filename(file))
+    return file_ids, failed_names
+
+def is_bot_reaction(payload: discord.RawReactionActionEvent):
+    """Bot (自分を含む) が付けた / 外したリアクションか"""
+    if payload.member is not None:
+        return payload.member.bot
+    user = bot.get_user(payload.user_id)
+    return payload.user_id == bot.user.id or (user is not None and user.bot)
+
+def reaction_payload(payload: discord.RawReactionActionEvent):
+    return {"channel_id": payload.channel_id, "message_id": payload.message_id, "emoji": str(payload.emoji)}
 
 @bot.event
-async def on_reaction_add(reaction, user):
-    if user.bot:
+async def on_raw_reaction_add(payload: discord.RawReactionActionEvent):
+    # キャッシュにない古いメッセージへのリアクションも受け取れるよう raw イベントを使う
+    if is_bot_reaction(payload):
         return
 
-    if reaction.message.channel.id == DISCORD_CHANNEL_ID_1 or reaction.message.channel.id == DISCORD_CHANNEL_ID_2:
-        try:
-            # メッセージIDをキーとしてSlackのts（タイムスタンプ）を取得
-            slack_ts = message_cache.get(str(reaction.message.id))
-            if slack_ts:
-                emoji = EmojiMapper.discord_to_slack(str(reaction.emoji))
-                if emoji:
-                    await slack_client.reactions_add(
-                        channel=DTOS[reaction.message.channel.id],
-                        timestamp=slack_ts,
-                        name=emoji.strip(':')
-                    )
-                    logging.info(f"Reaction synced to Slack: {emoji}")
-        except Exception as e:
+    if router.primary("discord", payload.channel_id) is not None:
+        outbox.enqueue(
+            "discord_reaction_add", delivery_key("discord", payload.channel_id), reaction_payload(payload),
+        )
+
+@outbox.handler("discord_reaction_add")
+async def deliver_reaction_add(payload, live):
+    try:
+        # メッセージIDをキーとしてSlackのts（タイムスタンプ）と転送したチャンネルを取得 (キャッシュ → DB)
+        slack_ts, channel_id = await get_slack_location_async(payload["message_id"])
+        if slack_ts:
+            emoji = EmojiMapper.discord_to_slack(payload["emoji"])
+            route = router.primary("discord", payload["channel_id"])
+            if emoji and route:
+                channel_id = channel_id or route.target
+                await slack_dispatcher.submit(channel_id, lambda: slack_client.reactions_add(
+                    channel=channel_id,
+                    timestamp=slack_ts,
+                    name=emoji.strip(':')
+                ), PRIORITY_REACTION)
+                logging.info(f"Reaction synced to Slack: {emoji}")
+    except SlackApiError as e:
+        # 再送時など、反映済みなら成功とみなす
+        if e.response.get("error") != "already_reacted":
             logging.error(f"Failed to sync reaction to Slack: {e}")
+            raise
+    except Exception as e:
+        logging.error(f"Failed to sync reaction to Slack: {e}")
+        raise
 
 @bot.event
-async def on_reaction_remove(reaction, user):
-    if user.bot:
+async def on_raw_reaction_remove(payload: discord.RawReactionActionEvent):
+    if is_bot_reaction(payload):
         return
 
-    if reaction.message.channel.id == DISCORD_CHANNEL_ID_1 or reaction.message.channel.id == DISCORD_CHANNEL_ID_2:
-        try:
-            slack_ts = message_cache.get(str(reaction.message.id))
-            if slack_ts:
-                emoji = EmojiMapper.discord_to_slack(str(reaction.emoji))
-                if emoji:
-                    await slack_client.reactions_remove(
-                        channel=DTOS[reaction.message.channel.id],
-                        timestamp=slack_ts,
-                        name=emoji.strip(':')
-                    )
-                    logging.info(f"Reaction removed from Slack: {emoji}")
-        except Exception as e:
+    if router.primary("discord", payload.channel_id) is not None:
+        outbox.enqueue(
+            "discord_reaction_remove", delivery_key("discord", payload.channel_id), reaction_payload(payload),
+        )
+
+@outbox.handler("discord_reaction_remove")
+async def deliver_reaction_remove(payload, live):
+    try:
+        slack_ts, channel_id = await get_slack_location_async(payload["message_id"])
+        if slack_ts:
+            emoji = EmojiMapper.discord_to_slack(payload["emoji"])
+            route = router.primary("discord", payload["channel_id"])
+            if emoji and route:
+                channel_id = channel_id or route.target
+                await slack_dispatcher.submit(channel_id, lambda: slack_client.reactions_remove(
+                    channel=channel_id,
+                    timestamp=slack_ts,
+                    name=emoji.strip(':')
+                ), PRIORITY_REACTION)
+                logging.info(f"Reaction removed from Slack: {emoji}")
+    except SlackApiError as e:
+        if e.response.get("error") != "no_reaction":
             logging.error(f"Failed to remove reaction from Slack: {e}")
+            raise
+    except Exception as e:
+        logging.error(f"Failed to remove reaction from Slack: {e}")
+        raise
 
 async def start_discord_bot():
+    attach_http_session(slack_client)
     await bot.start(DISCORD_BOT_TOKEN)
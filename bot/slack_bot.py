@@ -5,27 +5,41 @@ from slack_bolt.adapter.socket_mode.aiohttp import AsyncSocketModeHandler
 from slack_sdk.web.async_client import AsyncWebClient
 from utils.emoji_mapper import EmojiMapper
 from services.database_service import *
+from services.directory_service import get_user_profile, get_channel_info
+from services.http_service import attach_http_session
+from services.delivery_service import delivery_key, edit_coalescer, reaction_batcher
+from services.outbox_service import outbox
+from services.routing_service import router
 from config import *
-from bot.discord_bot import send_to_discord, get_file_objs, edit_at_discord, delete_from_discord
+from utils.cache import ExpiringCache
+from bot.discord_bot import (
+    send_to_discord, get_file_objs, edit_at_discord, delete_from_discord,
+    add_reaction_at_discord, remove_reaction_at_discord,
+)
 
 slack_client = AsyncWebClient(token=SLACK_BOT_TOKEN)
-app = AsyncApp(client=slack_client)
-
-# チャンネルID
-CHANNEL_IDS = [SLACK_CHANNEL_ID_1, SLACK_CHANNEL_ID_2, SUB_CHANNEL_ID] + NOTIFY_CHANNEL_IDS
-DISCORD_CHANNEL_IDS = [DISCORD_CHANNEL_ID_1, DISCORD_CHANNEL_ID_2, DISCORD_CHANNEL_ID_3]
+# リスナーを実行してから ack する (イベントを outbox に記録し終えてから受信を確定するため)
+app = AsyncApp(client=slack_client, process_before_response=True)
 
 # 監視するユーザーリスト
 monitored_users = set()
 
+# まとめる前のリアクションの操作の記録 (channel, ts) -> [記録したIDを返す Future]
+reaction_records = {}
+
+# Slack のメッセージ (channel, ts) ごとのリアクションの状態
+# {"reactors": {リアクション: Bot 以外で付けているユーザーの set}, "applied": {リアクション: Discord に付けたか}}
+reaction_state = ExpiringCache(REACTION_STATE_SIZE, REACTION_STATE_TTL)
+
 async def get_slack_user_name(user_id):
-    user_info = await slack_client.users_info(user=user_id)
-    profile = user_info["user"]["profile"]
+    profile = await get_user_profile(slack_client, user_id)
+    if profile is None:
+        return "Unknown"
     return profile.get("display_name") or profile.get("real_name") or "Unknown"
 
 async def get_slack_channel_name(channel_id):
-    channel_info = await slack_client.conversations_info(channel=channel_id)
-    return channel_info["channel"]["name"]
+    channel_info = await get_channel_info(slack_client, channel_id)
+    return channel_info["name"] if channel_info else "unknown"
 
 async def get_slack_user(user_id):
     """
@@ -35,11 +49,9 @@ async def get_slack_user(user_id):
         (display_name: str, avatar_url: str or None)
     """
     try:
-        resp = await slack_client.users_info(user=user_id)
-        if not resp["ok"]:
+        profile = await get_user_profile(slack_client, user_id)
+        if profile is None:
             return "Unknown", None
-        user = resp["user"]
-        profile = user.get("profile", {})
 
         # Prefer display_name over real_name
         display_name = profile.get("display_name") or profile.get("real_name") or "Unknown"
@@ -58,36 +70,101 @@ async def get_slack_user(user_id):
         print(f"Error fetching Slack user {user_id}: {e}")
         return "Unknown", None
 
+def slack_delivery_key(event):
+    """メッセージイベントの順序を保つ単位 (チャンネル、スレッド内の返信ならスレッド)"""
+    message = event.get("message") or event.get("previous_message") or event
+    thread_ts = message.get("thread_ts")
+    if thread_ts == message.get("ts"):
+        # スレッドの親メッセージはチャンネル本体と同じ順序で扱う
+        thread_ts = None
+    return delivery_key("slack", event.get("channel"), thread_ts)
+
+def is_bot_message(message, bot_user_id):
+    """Bot の投稿か (Discord から転送した投稿への chat_update や URL の展開も含む)"""
+    return (
+        bool(message.get("bot_id"))
+        or message.get("subtype") == "bot_message"
+        or (bot_user_id is not None and message.get("user") == bot_user_id)
+    )
+
+async def wait_recorded(saved):
+    """outbox への記録が終わるまで待つ (process_before_response なので、この後で Slack に ack を返す)"""
+    if saved is None:
+        return
+    try:
+        await saved
+    except Exception:
+        # 記録の失敗は処理するときにログに出す
+        pass
+
 @app.event("message")
-async def process_slack_message(event, logger):
+async def process_slack_message(event, context):
+    # 転送対象のチャンネルなら outbox に記録してから ack し、同じチャンネル (スレッド) のイベントは受け取った順に処理する
+    channel = event.get("channel")
+    route = router.primary("slack", channel)
+    if route is None:
+        return
+    subtype = event.get("subtype")
+    key = slack_delivery_key(event)
+    if subtype == "message_changed":
+        message = event.get("message") or {}
+        if is_bot_message(message, context.get("bot_user_id")):
+            return
+        coalesce_key = ("slack", channel, message.get("ts"))
+        if route.apply(message.get("text", "")) is None:
+            logging.info("[NOFW] or prefix rule - skipped editing")
+            edit_coalescer.cancel(coalesce_key)
+            return
+        # 記録はすぐに行い、連続した編集はまとめて最後の内容だけを転送する (まとめられた編集の記録は消す)
+        saved = outbox.record("slack_message", key, event)
+        edit_coalescer.submit(
+            coalesce_key,
+            lambda: outbox.schedule(saved, "slack_message", key, event),
+            lambda: outbox.discard(saved),
+        )
+        await wait_recorded(saved)
+        return
+    if subtype == "message_deleted":
+        # 保留中の編集は反映しない
+        edit_coalescer.cancel(("slack", channel, event["deleted_ts"]))
+    await wait_recorded(outbox.enqueue("slack_message", key, event))
+
+@outbox.handler("slack_message")
+async def deliver_slack_message(event, live):
+    await handle_slack_message(event)
+
+async def handle_slack_message(event):
     try:
         if event.get("type") == "message":
             subtype = event.get("subtype")
 
             if subtype == "message_deleted":
                 slack_ts = event["deleted_ts"]
-                discord_message_id = get_discord_id(slack_ts)
+                # 転送したときのチャンネルを使う (記録がなければ経路の転送先)
+                discord_message_id, discord_channel = await get_discord_location_async(slack_ts)
                 if discord_message_id is not None:
                     channel = event["channel"]
-                    if channel in CHANNEL_IDS:
+                    route = router.primary("slack", channel)
+                    if route is not None:
                         channel_name = await get_slack_channel_name(channel)
-                        await delete_from_discord(channel_name, STOD[channel], discord_message_id)
+                        await delete_from_discord(channel_name, discord_channel or route.target, discord_message_id)
                 return
 
             if subtype == "message_changed":
                 slack_ts = event["message"]["ts"]
-                discord_message_id = get_discord_id(slack_ts)
+                discord_message_id, discord_channel = await get_discord_location_async(slack_ts)
                 if discord_message_id is not None:
                     channel = event["channel"]
-                    if channel in CHANNEL_IDS:
-                        user = event["message"]["user"]
-                        new_text = event["message"]["text"]
-                        if NOFW in new_text:
-                            logging.info("[NOFW] detected - skipped editing")
+                    route = router.primary("slack", channel)
+                    user = event["message"].get("user")
+                    if route is not None and user:
+                        new_text = route.apply(event["message"].get("text", ""))
+                        if new_text is None:
+                            logging.info("[NOFW] or prefix rule - skipped editing")
                             return
                         channel_name = await get_slack_channel_name(channel)
                         user_name = await get_slack_user_name(user)
-                        await edit_at_discord(new_text, user_name, channel_name, STOD[channel], discord_message_id)
+                        await edit_at_discord(new_text, user_name, channel_name, discord_channel or route.target, discord_message_id)
                 return
 
             user = event.get("user")
@@ -95,40 +172,145 @@ async def process_slack_message(event, logger):
                 return
 
             message_text = event["text"]
-            if NOFW in message_text:
-                logging.info("[NOFW] detected - skipped sending")
+            channel = event.get("channel")
+            routes = router.routes_from("slack", channel)
+            if not routes:
+                return
+            if not router.forwards("slack", channel, message_text):
+                logging.info("[NOFW] or prefix rule - skipped sending")
                 return
 
-            channel = event.get("channel")
-            if channel in CHANNEL_IDS and user not in monitored_users:
+            if user not in monitored_users:
                 monitored_users.add(user)
                 logging.info(f"Added user {user} to monitored users.")
 
-            if channel in CHANNEL_IDS and user in monitored_users:
+            if user in monitored_users:
+                slack_ts = event["ts"]
+                # 再送時、転送済みのメッセージは送らない
+                if await get_discord_id_async(slack_ts) is not None:
+                    return
+
                 channel_name = await get_slack_channel_name(channel)
                 user_name = await get_slack_user_name(user)
-                # ファイル添付の確認
                 files = event.get("files", [])
-                file_objs = None
-                if files:
-                    file_objs = await get_file_objs(files)
-                
-                slack_ts = event["ts"]
+                for route in routes:
+                    text = route.apply(message_text)
+                    if text is None:
+                        continue
+                    try:
+                        # ファイル添付の確認 (送信後に閉じるので経路ごとに用意する)
+                        file_objs, failed_files = None, None
+                        if files:
+                            file_objs, failed_files = await get_file_objs(files)
 
-                # handle_slack_events メソッド内の send_to_discord の呼び出し部分
-                await send_to_discord(
-                    message_text=message_text,
-                    user_name=user_name,
-                    channel_name=channel_name,
-                    channel_id=STOD[channel],
-                    slack_ts=slack_ts,
-                    file_objs=file_objs
-                )
+                        # handle_slack_events メソッド内の send_to_discord の呼び出し部分
+                        await send_to_discord(
+                            message_text=text,
+                            user_name=user_name,
+                            channel_name=channel_name,
+                            channel_id=route.target,
+                            slack_ts=slack_ts,
+                            file_objs=file_objs,
+                            slack_channel=channel,
+                            failed_files=failed_files,
+                            record=route.primary,
+                        )
+                    except Exception as e:
+                        # primary 以外の経路 (新しいメッセージだけを転送する) の失敗では再送しない
+                        if route.primary:
+                            raise
+                        logging.error(f"Failed to send message to Discord channel {route.target}: {e}")
     except Exception as e:
         logging.error(f"Error handling Slack event: {e}")
         logging.debug(f"Event data: {event}")
+        raise
+
+@app.event("reaction_added")
+async def process_slack_reaction_added(event, context):
+    await wait_recorded(queue_slack_reaction(event, context, True))
+
+@app.event("reaction_removed")
+async def process_slack_reaction_removed(event, context):
+    await wait_recorded(queue_slack_reaction(event, context, False))
+
+def queue_slack_reaction(event, context, added):
+    """
+    リアクションの操作を1件ずつ outbox に記録し、メッセージごとにまとめてから処理する
+    (まとめたものを記録したら1件ずつの記録は消す)。記録したIDを返す Future を返す (対象外なら None)
+    """
+    item = event.get("item", {})
+    channel = item.get("channel")
+    if item.get("type") != "message" or router.primary("slack", channel) is None:
+        return None
+    # Discord のリアクションを Slack に反映したもの (Bot 自身) は戻さない
+    bot_user_id = context.get("bot_user_id")
+    if event.get("user") == bot_user_id:
+        return None
+    ts = item["ts"]
+    key = delivery_key("slack", channel)
+
+    def payload(changes):
+        return {"channel": channel, "ts": ts, "changes": changes, "bot_user_id": bot_user_id}
+
+    def flush(changes):
+        outbox.enqueue("slack_reactions", key, payload(changes))
+        for saved in reaction_records.pop((channel, ts), []):
+            outbox.discard(saved)
+
+    saved = outbox.record("slack_reactions", key, payload({event["reaction"]: {event["user"]: added}}))
+    reaction_records.setdefault((channel, ts), []).append(saved)
+    reaction_batcher.submit((channel, ts), event["reaction"], event["user"], added, flush)
+    return saved
+
+async def fetch_slack_reactors(channel, ts, bot_user_id):
+    """メッセージに今付いているリアクションと、付けているユーザー (Bot 以外)"""
+    response = await slack_client.reactions_get(channel=channel, timestamp=ts, full=True)
+    reactions = response.get("message", {}).get("reactions", [])
+    return {r["name"]: set(r.get("users", [])) - {bot_user_id} for r in reactions}
+
+@outbox.handler("slack_reactions")
+async def deliver_slack_reactions(payload, live):
+    """まとめたリアクションの操作のうち、Discord 側の状態が変わるものだけを反映する"""
+    channel, ts, changes = payload["channel"], payload["ts"], payload["changes"]
+    discord_message_id, discord_channel = await get_discord_location_async(ts)
+    route = router.primary("slack", channel)
+    if discord_message_id is None or route is None:
+        return
+    discord_channel = discord_channel or route.target
+
+    state = reaction_state.get((channel, ts))
+    if state is None:
+        # 再起動後などで状態が分からないときは Slack から取り直す (changes も反映済み)
+        state = {"reactors": await fetch_slack_reactors(channel, ts, payload["bot_user_id"]), "applied": {}}
+        reaction_state[(channel, ts)] = state
+    else:
+        for reaction, users in changes.items():
+            reactors = state["reactors"].setdefault(reaction, set())
+            for user, added in users.items():
+                if added:
+                    reactors.add(user)
+                else:
+                    reactors.discard(user)
+
+    for reaction in changes:
+        present = bool(state["reactors"].get(reaction))
+        if state["applied"].get(reaction) == present:
+            continue
+        emoji = EmojiMapper.slack_to_discord(reaction)
+        if emoji is None:
+            logging.info(f"No Discord emoji for Slack reaction :{reaction}:")
+            continue
+        if present:
+            await add_reaction_at_discord(discord_channel, discord_message_id, emoji)
+        else:
+            await remove_reaction_at_discord(discord_channel, discord_message_id, emoji)
+        state["applied"][reaction] = present
+        logging.info(f"Reaction synced to Discord: :{reaction}: ({'added' if present else 'removed'})")
+
+async def ack_file_event():
+    # ログに出すだけなので files.info を待たずに ack する (後の関数は lazy で ack の後に実行される)
+    pass
 
-@app.event("file_shared")
 async def handle_file_shared(event, logger):
     file_id = event['file_id']
     resp = await slack_client.files_info(file=file_id)
@@ -139,7 +321,6 @@ async def handle_file_shared(event, logger):
     username = await get_slack_user_name(file["user"])
     logger.info(f"Slack event: File {filename} shared by {username}")
 
-@app.event("file_created")
 async def handle_file_created(event, logger):
     file_id = event['file_id']
     resp = await slack_client.files_info(file=file_id)
@@ -150,7 +331,11 @@ async def handle_file_created(event, logger):
     username = await get_slack_user_name(file["user"])
     logger.info(f"Slack event: File {filename} created by {username}")
 
+app.event("file_shared")(ack=ack_file_event, lazy=[handle_file_shared])
+app.event("file_created")(ack=ack_file_event, lazy=[handle_file_created])
+
 async def start_slack_bot():
+    attach_http_session(slack_client)
     slack_handler = AsyncSocketModeHandler(app, SLACK_APP_TOKEN)
     await slack_handler.start_async()
 
@@ -5,6 +5,14 @@ SLACK_APP_TOKEN = "YOUR_TOKEN"  # Slack App Level Token
 SLACK_VERIFICATION_TOKEN = "YOUR_TOKEN" # Verification Token
 DISCORD_BOT_TOKEN = "YOUR_TOKEN" # Discord Bot Token
 DATABASE_URL = "sqlite:///migration.db" # データベースのURL
+MAPPING_FLUSH_INTERVAL = 0.2 # メッセージ対応表の書き込みをまとめる間隔 (秒)
+MAPPING_FLUSH_ROWS = 200 # この件数が溜まったら即座にコミット
+MAPPING_FLUSH_BACKOFF_MAX = 60 # コミットに失敗したときの再試行間隔の上限 (秒)
+MAPPING_CACHE_SIZE = 20000 # メモリ上に保持する対応表の最大件数
+MAPPING_WARM_ROWS = 5000 # 起動時にキャッシュへ読み込む直近の対応表の件数
+MAPPING_RETENTION_DAYS = 180 # これより古い対応表は削除 (None で無効)
+MAPPING_COMPACTION_INTERVAL = 6 * 60 * 60 # 削除処理の実行間隔 (秒)
+MAPPING_COMPACTION_BATCH = 500 # 1トランザクションで削除する最大行数
 NGROK_AUTH_TOKEN = "YOUR_TOKEN" # ngrokの認証トークン
 NOFW = "[NOFW]"
 
@@ -20,6 +28,11 @@ NOTIFY_CHANNEL_IDS = [
     'C0812345678',
 ]
 
+# 転送経路 (Slack ⇄ Discord のチャンネルの対応) のファイル。routes.example.json を参照
+# 変更すると ROUTES_RELOAD_INTERVAL 秒以内に読み込み直す (再起動不要)。ファイルがなければ下の STOD / DTOS を使う
+ROUTES_FILE = "data/routes.json"
+ROUTES_RELOAD_INTERVAL = 10 # 秒
+
 STOD = {
     SLACK_CHANNEL_ID_1: DISCORD_CHANNEL_ID_1,
     SLACK_CHANNEL_ID_2: DISCORD_CHANNEL_ID_2,
@@ -47,10 +60,74 @@ DISCORD_ROLE_ID = 1234567890
 DISCORD_ARXIV_CHANNEL_ID = 1234567890
 DISCORD_LOG_CHANNEL_ID = 1234567890
 
+# discord.py のメッセージキャッシュ件数 (編集・削除・リアクションは raw イベントと対応表で同期するので不要。None で無効)
+DISCORD_MAX_MESSAGES = None
+
+# Discord の転送 (forward) 元をたどるための、最近見たメッセージのキャッシュ
+REFERENCE_CACHE_SIZE = 1000 # 最大件数
+REFERENCE_CACHE_TTL = 6 * 60 * 60 # 秒
+REFERENCE_NEGATIVE_TTL = 5 * 60 # 取得できなかった参照先を覚えておく秒数
+REFERENCE_MAX_HOPS = 5 # 参照をたどる最大回数
+
+# 転送済みメッセージの重複チェック
+MESSAGE_CACHE_SIZE = 10000 # 最大エントリ数
+MESSAGE_CACHE_TTL = 5 * 60 # 秒
+
+# Slack ユーザー / チャンネル名キャッシュ
+DIRECTORY_CACHE_SIZE = 4096  # 最大エントリ数
+DIRECTORY_CACHE_TTL = 60 * 60  # 秒
+DIRECTORY_NEGATIVE_TTL = 5 * 60  # 存在しないIDを覚えておく秒数
+MENTION_RESOLVE_CONCURRENCY = 8  # メンション解決の同時リクエスト数
+
 # ファイル転送の設定を追加
 
 # 最大ファイルサイズ (50MB)
 MAX_FILE_SIZE = 50 * 1024 * 1024
+FILE_CHUNK_SIZE = 64 * 1024 # ストリーミング転送のチャンクサイズ
+FILE_SPOOL_MEMORY_LIMIT = 1024 * 1024 # これを超える添付ファイルは一時ファイルに書き出す
+ATTACHMENT_CONCURRENCY = 4 # 同時に転送する添付ファイル数
+ATTACHMENT_BYTES_IN_FLIGHT = 200 * 1024 * 1024 # 転送中の添付ファイルの合計サイズ上限
+ATTACHMENT_TIMEOUT = 120 # 添付ファイル1件あたりの転送タイムアウト (秒)
+ATTACHMENT_CACHE_DIR = "data/attachments" # 転送済み添付ファイルのキャッシュ (SHA-256 で管理)
+ATTACHMENT_CACHE_MAX_BYTES = 2 * 1024 * 1024 * 1024 # キャッシュの合計サイズ上限 (0 で無効)
+ATTACHMENT_INDEX_SAVE_DELAY = 5 # キャッシュの索引の保存をまとめる間隔 (秒)
+
+# 共有HTTPセッションの設定
+HTTP_POOL_LIMIT = 100 # 全体の最大同時接続数
+HTTP_POOL_LIMIT_PER_HOST = 16 # ホストごとの最大同時接続数
+HTTP_DNS_CACHE_TTL = 300 # DNS キャッシュの保持秒数
+HTTP_KEEPALIVE_TIMEOUT = 30 # アイドル接続を保持する秒数
+HTTP_TIMEOUT = 300 # 1リクエストの最大秒数 (大きなファイル転送を考慮)
+
+# 送信キュー (レート制限) の設定: 送信先チャンネルごとのトークンバケット + プラットフォーム全体のバケット
+# Slack: chat.postMessage はチャンネルごとに約 1件/秒 (短いバーストは許容)
+SLACK_RATE_PER_CHANNEL = 1.0 # 件/秒
+SLACK_BURST_PER_CHANNEL = 3
+SLACK_RATE_GLOBAL = 5.0 # ワークスペース全体 (件/秒)
+SLACK_BURST_GLOBAL = 10
+# Discord: チャンネルごとに 5件/5秒, Bot 全体で 50件/秒
+DISCORD_RATE_PER_CHANNEL = 1.0
+DISCORD_BURST_PER_CHANNEL = 5
+DISCORD_RATE_GLOBAL = 50.0
+DISCORD_BURST_GLOBAL = 50
+OUTBOUND_MAX_RETRIES = 5 # Slack の 429 (Retry-After) を受けたときの最大再送回数
+
+# 連続した編集をまとめる (最後の編集から EDIT_COALESCE_WINDOW 秒待って最新の内容だけ反映)
+EDIT_COALESCE_WINDOW = 1.5 # 秒 (0 で無効)
+EDIT_COALESCE_MAX_DELAY = 5 # 編集が続いても最初の編集からこの秒数以内に反映する
+
+# Slack のリアクションをメッセージごとに REACTION_BATCH_WINDOW 秒ためて、差分だけを Discord に反映する
+REACTION_BATCH_WINDOW = 2.0 # 秒
+REACTION_STATE_SIZE = 5000 # リアクションの状態を覚えておくメッセージ数
+REACTION_STATE_TTL = 24 * 60 * 60 # 秒 (期限切れ後は Slack から取り直す)
+
+# 受信イベントの outbox (転送に失敗したイベントの再送)
+OUTBOX_MAX_ATTEMPTS = 8 # この回数失敗したら dead_letters テーブルに移す
+OUTBOX_BACKOFF_BASE = 2 # 再送間隔の初期値 (秒)。失敗のたびに2倍
+OUTBOX_BACKOFF_MAX = 10 * 60 # 再送間隔の上限 (秒)
+
+# Slack ワークスペースのカスタム絵文字 (emoji.list) を取り直す間隔 (秒)
+SLACK_EMOJI_REFRESH_INTERVAL = 6 * 60 * 60
 
 # NewsAPI設定
 NEWS_API_KEY = "YOUR_API_KEY"
@@ -71,8 +148,11 @@ REQUIRED_BOT_SCOPES = [
     "channels:history",
     "channels:read",
     "chat:write",
+    "emoji:read",
     "files:read",
     "im:history",
+    "reactions:read",
+    "reactions:write",
     "users:read"
 ]
 
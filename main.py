@@ -2,9 +2,15 @@ import asyncio
 import logging
 import tracemalloc
 
-from bot.discord_bot import start_discord_bot
+from bot.discord_bot import bot, slack_client, start_discord_bot
 from bot.slack_bot import start_slack_bot
-from config import LOG_LEVEL
+from config import LOG_LEVEL, MAPPING_WARM_ROWS
+from services.database_service import init_db, close_db, run_mapping_compaction, warm_mapping_cache_async
+from services.http_service import close_http_session
+from services.file_service import attachment_cache
+from services.outbox_service import outbox
+from services.routing_service import router
+from utils.emoji_mapper import EmojiMapper
 
 # トレースバック追跡を有効化
 tracemalloc.start()
@@ -15,10 +21,27 @@ logging.basicConfig(
 )
 
 async def main():
-    await asyncio.gather(
-        start_discord_bot(),
-        start_slack_bot(),
-    )
+    # DBスキーマを最新バージョンにマイグレーション
+    init_db()
+    try:
+        # 再起動後もリアクション同期などが DB を引かずに済むよう、直近の対応表を読み込む
+        warmed = await warm_mapping_cache_async(MAPPING_WARM_ROWS)
+        logging.info(f"Loaded {warmed} recent message mappings into cache")
+        await asyncio.gather(
+            start_discord_bot(),
+            start_slack_bot(),
+            run_mapping_compaction(),
+            # 前回の未完了のイベントを新しいイベントより先に積み、Discord の接続完了後に再送する
+            outbox.run(ready=bot.wait_until_ready),
+            # リアクションの変換に使う Slack のカスタム絵文字を定期的に取り直す
+            EmojiMapper.run_custom_emoji_refresh(slack_client),
+            # 転送経路のファイルが変更されたら、接続を切らずに読み込み直す
+            router.run_reload(),
+        )
+    finally:
+        attachment_cache.save_index()
+        await close_http_session()
+        close_db()
 
 if __name__ == "__main__":
     asyncio.run(main())
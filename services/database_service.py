@@ -1,49 +1,750 @@
-from sqlalchemy import create_engine, Column, Integer, String
+import asyncio
+import functools
+import logging
+import threading
+from collections import OrderedDict, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+import json
+import time
+from sqlalchemy import create_engine, event, func, inspect, select, text, Column, DateTime, Integer, String, Text
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 
-from config import DATABASE_URL
+from config import (
+    DATABASE_URL, MAPPING_FLUSH_INTERVAL, MAPPING_FLUSH_ROWS, MAPPING_FLUSH_BACKOFF_MAX,
+    MAPPING_RETENTION_DAYS, MAPPING_COMPACTION_INTERVAL, MAPPING_COMPACTION_BATCH,
+    MAPPING_CACHE_SIZE,
+)
 
 Base = declarative_base()
-engine = create_engine(DATABASE_URL)
+connect_args = {"check_same_thread": False} if DATABASE_URL.startswith("sqlite") else {}
+engine = create_engine(DATABASE_URL, connect_args=connect_args)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# 接続ごとに設定する SQLite の PRAGMA
+SQLITE_PRAGMAS = {
+    "auto_vacuum": "INCREMENTAL",  # 新規DBのみ有効 (既存DBは init_db で VACUUM して切り替え)
+    "journal_mode": "WAL",      # 読み取りが書き込みをブロックしない
+    "synchronous": "NORMAL",    # WAL では NORMAL でもクラッシュ時に壊れない
+    "busy_timeout": 5000,       # ms
+    "temp_store": "MEMORY",
+    "cache_size": -8000,        # 負の値は KiB 単位 (約8MB)
+}
+
+@event.listens_for(engine, "connect")
+def _set_sqlite_pragmas(dbapi_connection, connection_record):
+    if engine.dialect.name != "sqlite":
+        return
+    cursor = dbapi_connection.cursor()
+    for name, value in SQLITE_PRAGMAS.items():
+        cursor.execute(f"PRAGMA {name}={value}")
+    cursor.close()
+
+# DB アクセスを直列に実行する専用スレッド (イベントループをブロックしないため)
+_db_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="mapping-db")
+
 class MessageMap(Base):
     __tablename__ = "message_map"
 
-    slack_ts = Column(String, primary_key=True, nullable=True)   # Slack timestamp (ts)
-    discord_id = Column(String, primary_key=True, nullable=True) # Discord message ID
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    slack_ts = Column(String, nullable=True, unique=True, index=True)    # Slack timestamp (ts)
+    discord_id = Column(String, nullable=True, unique=True, index=True)  # Discord message ID
+    slack_channel = Column(String, nullable=True)    # Slack channel ID
+    discord_channel = Column(String, nullable=True)  # Discord channel ID
+    created_at = Column(DateTime, nullable=False, server_default=func.current_timestamp(), index=True)
+
+class OutboxEntry(Base):
+    """処理前に記録した受信イベント (転送が完了したら削除する)"""
+    __tablename__ = "outbox"
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    kind = Column(String, nullable=False)    # イベントの種類 (outbox の handler 名)
+    key = Column(String, nullable=False)     # 配信順序のキー (delivery_key)
+    payload = Column(Text, nullable=False)   # JSON
+    attempts = Column(Integer, nullable=False, default=0)
+    last_error = Column(Text, nullable=True)
+    created_at = Column(DateTime, nullable=False, server_default=func.current_timestamp())
+
+class DeadLetter(Base):
+    """再送の上限に達した受信イベント (確認用に残す)"""
+    __tablename__ = "dead_letters"
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    kind = Column(String, nullable=False)
+    key = Column(String, nullable=False)
+    payload = Column(Text, nullable=False)
+    attempts = Column(Integer, nullable=False)
+    last_error = Column(Text, nullable=True)
+    created_at = Column(DateTime, nullable=True)  # outbox に記録された日時
+    failed_at = Column(DateTime, nullable=False, server_default=func.current_timestamp())
+
+# --- スキーマのマイグレーション (PRAGMA user_version でバージョン管理) ---
+
+def _migrate_v1(conn):
+    """複合主キーの旧テーブルを、ID列・一意インデックス・チャンネルID・作成日時を持つテーブルに移行"""
+    if not inspect(conn).has_table(MessageMap.__tablename__):
+        MessageMap.__table__.create(conn)
+        return
+    conn.execute(text("ALTER TABLE message_map RENAME TO message_map_v0"))
+    # 旧テーブルのインデックス名と衝突しないよう、リネーム後に新テーブルを作成
+    MessageMap.__table__.create(conn)
+    conn.execute(text(
+        "INSERT OR REPLACE INTO message_map (slack_ts, discord_id) "
+        "SELECT slack_ts, discord_id FROM message_map_v0 "
+        "WHERE slack_ts IS NOT NULL OR discord_id IS NOT NULL"
+    ))
+    conn.execute(text("DROP TABLE message_map_v0"))
+
+def _migrate_v2(conn):
+    """保持期間による削除のため created_at にインデックスを追加"""
+    conn.execute(text("CREATE INDEX IF NOT EXISTS ix_message_map_created_at ON message_map (created_at)"))
+
+def _migrate_v3(conn):
+    """受信イベントの outbox と dead-letter テーブルを追加"""
+    OutboxEntry.__table__.create(conn, checkfirst=True)
+    DeadLetter.__table__.create(conn, checkfirst=True)
+
+MIGRATIONS = [
+    _migrate_v1,
+    _migrate_v2,
+    _migrate_v3,
+]
+SCHEMA_VERSION = len(MIGRATIONS)
+
+_DELETED = object()
+_MISSING = object()
+
+# 対応表の1行 (ID・チャンネルはすべて文字列。チャンネルを記録していなければ None)
+MappingRow = namedtuple("MappingRow", ["slack_ts", "discord_id", "slack_channel", "discord_channel"])
+
+class MappingCache:
+    """
+    slack_ts ⇄ discord_id の双方向 LRU キャッシュ (記録したチャンネルも MappingRow で一緒に持つ)。
+    maxsize 組を超えると最も古く参照された組から削除する。
+    """
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self._lock = threading.Lock()
+        self._by_slack = OrderedDict()  # slack_ts -> MappingRow (LRU 順)
+        self._by_discord = {}           # discord_id -> MappingRow
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._by_slack)
+
+    def put(self, row):
+        if row.slack_ts is None or row.discord_id is None:
+            return
+        with self._lock:
+            old = self._by_discord.get(row.discord_id)
+            self._discard_locked(row.slack_ts, old.slack_ts if old else None)
+            self._by_slack[row.slack_ts] = row
+            self._by_discord[row.discord_id] = row
+            while len(self._by_slack) > self.maxsize:
+                _, old = self._by_slack.popitem(last=False)
+                self._by_discord.pop(old.discord_id, None)
+
+    def get_by_slack(self, slack_ts):
+        with self._lock:
+            row = self._by_slack.get(slack_ts)
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._by_slack.move_to_end(slack_ts)
+            return row
+
+    def get_by_discord(self, discord_id):
+        with self._lock:
+            row = self._by_discord.get(discord_id)
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._by_slack.move_to_end(row.slack_ts)
+            return row
+
+    def discard_slack(self, slack_ts):
+        with self._lock:
+            self._discard_locked(slack_ts)
+
+    def discard_discord(self, discord_id):
+        with self._lock:
+            row = self._by_discord.get(discord_id)
+            self._discard_locked(row.slack_ts if row else None)
+
+    def _discard_locked(self, *slack_ts_list):
+        for slack_ts in slack_ts_list:
+            if slack_ts is None:
+                continue
+            row = self._by_slack.pop(slack_ts, None)
+            if row is not None:
+                self._by_discord.pop(row.discord_id, None)
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "size": len(self),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / total if total else 0.0,
+        }
+
+class _Pending:
+    """未コミットの書き込み (操作ログと、読み取り用の slack_ts / discord_id -> MappingRow の索引)"""
+    def __init__(self):
+        self.ops = []
+        self.by_slack = {}
+        self.by_discord = {}
+
+class WriteBehindBuffer:
+    """
+    MessageMap への upsert / delete を溜めておき、flush_interval 秒ごと
+    または max_rows 件ごとに1トランザクションでまとめてコミットする。
+    未コミットの内容は lookup_* で参照できる。
+    コミットに失敗したら指数バックオフ (最大 backoff_max 秒) で再試行する。
+    """
+
+    def __init__(self, flush_interval, max_rows, backoff_max):
+        self.flush_interval = flush_interval
+        self.max_rows = max_rows
+        self.backoff_max = backoff_max
+        self._failures = 0  # 連続して失敗した回数 (0 以外の間は件数が溜まっても即座にはコミットしない)
+        self._lock = threading.Lock()
+        self._pending = _Pending()
+        self._flushing = None  # コミット中のバッチ (コミット完了まで読み取りに使う)
+        self._timer = None
+        self.flushes = 0
+        self.rows_written = 0
+
+    def __len__(self):
+        return len(self._pending.ops)
+
+    def save(self, slack_ts, discord_id, slack_channel=None, discord_channel=None):
+        with self._lock:
+            self._pending.ops.append(("save", slack_ts, discord_id, (slack_channel, discord_channel)))
+            # 片方だけの行は「情報なし」として索引に入れる (DB を引き直す)
+            row = None
+            if slack_ts is not None and discord_id is not None:
+                row = MappingRow(slack_ts, discord_id, slack_channel, discord_channel)
+            if slack_ts is not None:
+                self._pending.by_slack[slack_ts] = row
+            if discord_id is not None:
+                self._pending.by_discord[discord_id] = row
+            self._schedule_locked()
+
+    def delete_by_slack(self, slack_ts):
+        with self._lock:
+            self._pending.ops.append(("delete_slack", slack_ts, None, None))
+            row = self._lookup_locked("by_slack", slack_ts)
+            self._pending.by_slack[slack_ts] = _DELETED
+            if row is not None and row is not _DELETED:
+                self._pending.by_discord[row.discord_id] = _DELETED
+            self._schedule_locked()
+
+    def complete_outbox(self, entry_id):
+        """転送が終わった outbox のイベントを、それまでの対応表の書き込みと同じトランザクションで削除する"""
+        with self._lock:
+            self._pending.ops.append(("delete_outbox", None, entry_id, None))
+            self._schedule_locked()
+
+    def delete_by_discord(self, discord_id):
+        with self._lock:
+            self._pending.ops.append(("delete_discord", None, discord_id, None))
+            row = self._lookup_locked("by_discord", discord_id)
+            self._pending.by_discord[discord_id] = _DELETED
+            if row is not None and row is not _DELETED:
+                self._pending.by_slack[row.slack_ts] = _DELETED
+            self._schedule_locked()
+
+    def lookup_by_slack(self, slack_ts):
+        """未コミットの MappingRow を返す。None=情報なし、_DELETED=削除予定"""
+        with self._lock:
+            return self._lookup_locked("by_slack", slack_ts)
+
+    def lookup_by_discord(self, discord_id):
+        with self._lock:
+            return self._lookup_locked("by_discord", discord_id)
+
+    def _lookup_locked(self, index, key):
+        for batch in (self._pending, self._flushing):
+            if batch is not None and key in getattr(batch, index):
+                return getattr(batch, index)[key]
+        return None
+
+    def _schedule_locked(self):
+        if len(self._pending.ops) >= self.max_rows and not self._failures:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            try:
+                _db_executor.submit(self.flush)
+            except RuntimeError:
+                # close_db() 後は最終 flush 済み
+                pass
+        elif self._timer is None:
+            delay = self.flush_interval
+            if self._failures:
+                delay = min(self.backoff_max, self.flush_interval * 2 ** self._failures)
+            self._timer = threading.Timer(delay, self._on_timer)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def _on_timer(self):
+        with self._lock:
+            self._timer = None
+        try:
+            _db_executor.submit(self.flush)
+        except RuntimeError:
+            # close_db() 後は最終 flush 済み
+            pass
+
+    def flush(self):
+        """溜まっている書き込みを1トランザクションでコミット (DBスレッドから呼ぶ)。未コミットの書き込みが残ったら False"""
+        with self._lock:
+            if not self._pending.ops:
+                return True
+            batch, self._pending = self._pending, _Pending()
+            self._flushing = batch
+        try:
+            with SessionLocal() as session:
+                rows = []
+                outbox_ids = []
+                for op, slack_ts, discord_id, channels in batch.ops:
+                    if op == "delete_outbox":
+                        outbox_ids.append(discord_id)
+                        continue
+                    if op == "save":
+                        rows.append({
+                            "slack_ts": slack_ts,
+                            "discord_id": discord_id,
+                            "slack_channel": channels[0],
+                            "discord_channel": channels[1],
+                        })
+                        continue
+                    # 順序を保つため、delete の前に溜まった upsert をまとめて実行
+                    _upsert_rows(session, rows)
+                    rows = []
+                    if op == "delete_slack":
+                        session.execute(MessageMap.__table__.delete().where(MessageMap.slack_ts == slack_ts))
+                    else:
+                        session.execute(MessageMap.__table__.delete().where(MessageMap.discord_id == discord_id))
+                _upsert_rows(session, rows)
+                if outbox_ids:
+                    session.execute(_outbox.delete().where(_outbox.c.id.in_(outbox_ids)))
+                session.commit()
+        except Exception as e:
+            with self._lock:
+                self._failures += 1
+                logging.error(
+                    f"Failed to flush {len(batch.ops)} message mappings (attempt {self._failures}, "
+                    f"retrying in {min(self.backoff_max, self.flush_interval * 2 ** self._failures):.1f}s): {e}"
+                )
+                # 失敗したバッチを先頭に戻して次回再試行
+                batch.ops.extend(self._pending.ops)
+                for key, value in self._pending.by_slack.items():
+                    batch.by_slack[key] = value
+                for key, value in self._pending.by_discord.items():
+                    batch.by_discord[key] = value
+                self._pending = batch
+                self._flushing = None
+                # 指数バックオフで再試行 (待っている間に溜まった書き込みも一緒にコミットする)
+                if self._timer is not None:
+                    self._timer.cancel()
+                    self._timer = None
+                self._schedule_locked()
+            return False
+        with self._lock:
+            self._flushing = None
+            self._failures = 0
+            self.flushes += 1
+            self.rows_written += len(batch.ops)
+            if self._pending.ops:
+                # バックオフ中に溜まった分は通常の間隔で
+                if self._timer is not None:
+                    self._timer.cancel()
+                    self._timer = None
+                self._schedule_locked()
+        return True
+
+    def stats(self):
+        return {
+            "pending": len(self),
+            "flushes": self.flushes,
+            "rows_written": self.rows_written,
+            "failures": self._failures,
+        }
+
+def _upsert_rows(session, rows):
+    if not rows:
+        return
+    # slack_ts / discord_id のどちらかが衝突した既存行は置き換える
+    stmt = sqlite_insert(MessageMap).prefix_with("OR REPLACE")
+    session.execute(stmt, rows)
+
+write_buffer = WriteBehindBuffer(MAPPING_FLUSH_INTERVAL, MAPPING_FLUSH_ROWS, MAPPING_FLUSH_BACKOFF_MAX)
+last_compaction = None  # 直近の compact_mappings の結果
+mapping_cache = MappingCache(MAPPING_CACHE_SIZE)
 
 def init_db():
-    Base.metadata.create_all(bind=engine)
+    """テーブルを作成し、既存DBを SCHEMA_VERSION まで順にマイグレーション"""
+    global _outbox_boot_id
+    with engine.begin() as conn:
+        version = conn.execute(text("PRAGMA user_version")).scalar()
+        for target in range(version, SCHEMA_VERSION):
+            logging.info(f"Migrating database schema to version {target + 1}")
+            MIGRATIONS[target](conn)
+            conn.execute(text(f"PRAGMA user_version = {target + 1}"))
+        Base.metadata.create_all(bind=conn)
+        # これ以前のイベントは前回のプロセスの未完了分 (起動後に記録されたものと区別する)
+        _outbox_boot_id = conn.execute(select(func.max(OutboxEntry.id))).scalar()
+
+    if engine.dialect.name == "sqlite":
+        # auto_vacuum の変更はトランザクション外での VACUUM が必要
+        with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+            if conn.exec_driver_sql("PRAGMA auto_vacuum").scalar() != 2:  # 2 = INCREMENTAL
+                logging.info("Enabling incremental auto_vacuum (running VACUUM once)")
+                conn.exec_driver_sql("PRAGMA auto_vacuum = INCREMENTAL")
+                conn.exec_driver_sql("VACUUM")
+
+def close_db():
+    """未コミットの書き込みを flush し、DBスレッドを停止"""
+    _db_executor.submit(write_buffer.flush)
+    _db_executor.shutdown(wait=True)
+    engine.dispose()
 
-def save_mapping(slack_ts=None, discord_id=None):
-    session = SessionLocal()
-    mapping = MessageMap(slack_ts=slack_ts, discord_id=discord_id)
-    session.merge(mapping)   # upsert
-    session.commit()
-    session.close()
+def save_mapping(slack_ts=None, discord_id=None, slack_channel=None, discord_channel=None):
+    discord_id = None if discord_id is None else str(discord_id)
+    discord_channel = None if discord_channel is None else str(discord_channel)
+    mapping_cache.put(MappingRow(slack_ts, discord_id, slack_channel, discord_channel))
+    write_buffer.save(slack_ts, discord_id, slack_channel, discord_channel)
+
+# 参照は キャッシュ → 未コミットの書き込み → SQLite の順に行う
+
+def _cached_by_slack(slack_ts):
+    row = mapping_cache.get_by_slack(slack_ts)
+    if row is not None:
+        return row
+    pending = write_buffer.lookup_by_slack(slack_ts)
+    if pending is None:
+        return _MISSING
+    return None if pending is _DELETED else pending
+
+def _cached_by_discord(discord_id):
+    row = mapping_cache.get_by_discord(discord_id)
+    if row is not None:
+        return row
+    pending = write_buffer.lookup_by_discord(discord_id)
+    if pending is None:
+        return _MISSING
+    return None if pending is _DELETED else pending
+
+_ROW_COLUMNS = (MessageMap.slack_ts, MessageMap.discord_id, MessageMap.slack_channel, MessageMap.discord_channel)
+
+def _query_by_slack(slack_ts):
+    with SessionLocal() as session:
+        row = session.execute(select(*_ROW_COLUMNS).where(MessageMap.slack_ts == slack_ts)).first()
+    if row is None or row.discord_id is None or write_buffer.lookup_by_discord(row.discord_id) is _DELETED:
+        return None
+    row = MappingRow(*row)
+    mapping_cache.put(row)
+    return row
+
+def _query_by_discord(discord_id):
+    with SessionLocal() as session:
+        row = session.execute(select(*_ROW_COLUMNS).where(MessageMap.discord_id == discord_id)).first()
+    if row is None or row.slack_ts is None or write_buffer.lookup_by_slack(row.slack_ts) is _DELETED:
+        return None
+    row = MappingRow(*row)
+    mapping_cache.put(row)
+    return row
+
+def _query_by_discord_many(discord_ids):
+    """複数の discord_id の行を1クエリで取得"""
+    with SessionLocal() as session:
+        rows = session.execute(select(*_ROW_COLUMNS).where(MessageMap.discord_id.in_(discord_ids))).all()
+    found = {}
+    for row in rows:
+        if row.slack_ts is None or write_buffer.lookup_by_slack(row.slack_ts) is _DELETED:
+            continue
+        row = MappingRow(*row)
+        mapping_cache.put(row)
+        found[row.discord_id] = row
+    return found
 
 def get_discord_id(slack_ts):
-    session = SessionLocal()
-    mapping = session.query(MessageMap).filter_by(slack_ts=slack_ts).first()
-    session.close()
-    return mapping.discord_id if mapping else None
+    row = _cached_by_slack(slack_ts)
+    if row is _MISSING:
+        row = _query_by_slack(slack_ts)
+    return None if row is None else row.discord_id
 
 def get_slack_ts(discord_id):
-    session = SessionLocal()
-    mapping = session.query(MessageMap).filter_by(discord_id=discord_id).first()
-    session.close()
-    return mapping.slack_ts if mapping else None
+    discord_id = str(discord_id)
+    row = _cached_by_discord(discord_id)
+    if row is _MISSING:
+        row = _query_by_discord(discord_id)
+    return None if row is None else row.slack_ts
 
 def delete_mapping_by_slack(slack_ts):
-    session = SessionLocal()
-    session.query(MessageMap).filter_by(slack_ts=slack_ts).delete()
-    session.commit()
-    session.close()
+    mapping_cache.discard_slack(slack_ts)
+    write_buffer.delete_by_slack(slack_ts)
 
 def delete_mapping_by_discord(discord_id):
-    session = SessionLocal()
-    session.query(MessageMap).filter_by(discord_id=discord_id).delete()
-    session.commit()
-    session.close()
+    discord_id = str(discord_id)
+    mapping_cache.discard_discord(discord_id)
+    write_buffer.delete_by_discord(discord_id)
+
+def warm_mapping_cache(limit):
+    """直近 limit 件の対応表をキャッシュに読み込む (起動時用)"""
+    with SessionLocal() as session:
+        rows = session.execute(
+            select(*_ROW_COLUMNS)
+            .where(MessageMap.slack_ts.is_not(None), MessageMap.discord_id.is_not(None))
+            .order_by(MessageMap.id.desc())
+            .limit(limit)
+        ).all()
+    # 古い順に入れて、新しいものほど LRU で後まで残るようにする
+    for row in reversed(rows):
+        mapping_cache.put(MappingRow(*row))
+    return len(rows)
+
+def mapping_stats():
+    """/stats 用の対応表キャッシュ・書き込みバッファ・compaction の統計"""
+    return {
+        "cache": mapping_cache.stats(),
+        "buffer": write_buffer.stats(),
+        "compaction": last_compaction,
+    }
+
+# --- async API: DB を読む処理は DB スレッド上で実行する ---
+
+async def _run_in_db_thread(func, *args):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_db_executor, functools.partial(func, *args))
+
+async def save_mapping_async(slack_ts=None, discord_id=None, slack_channel=None, discord_channel=None):
+    # write-behind バッファに積むだけなのでブロックしない
+    save_mapping(slack_ts, discord_id, slack_channel, discord_channel)
+
+async def _row_by_slack_async(slack_ts):
+    row = _cached_by_slack(slack_ts)
+    if row is _MISSING:
+        row = await _run_in_db_thread(_query_by_slack, slack_ts)
+    return row
+
+async def _row_by_discord_async(discord_id):
+    row = _cached_by_discord(discord_id)
+    if row is _MISSING:
+        row = await _run_in_db_thread(_query_by_discord, discord_id)
+    return row
+
+async def get_discord_id_async(slack_ts):
+    row = await _row_by_slack_async(slack_ts)
+    return None if row is None else row.discord_id
+
+async def get_slack_ts_async(discord_id):
+    row = await _row_by_discord_async(str(discord_id))
+    return None if row is None else row.slack_ts
+
+async def get_discord_location_async(slack_ts):
+    """
+    slack_ts を転送した Discord のメッセージ。
+    Returns:
+        (discord_id, 転送先のチャンネルID (int、記録していなければ None))。対応表になければ (None, None)
+    """
+    row = await _row_by_slack_async(slack_ts)
+    if row is None:
+        return None, None
+    return row.discord_id, None if row.discord_channel is None else int(row.discord_channel)
+
+async def get_slack_location_async(discord_id):
+    """
+    discord_id を転送した Slack のメッセージ。
+    Returns:
+        (slack_ts, 転送先のチャンネルID (記録していなければ None))。対応表になければ (None, None)
+    """
+    row = await _row_by_discord_async(str(discord_id))
+    if row is None:
+        return None, None
+    return row.slack_ts, row.slack_channel
+
+async def get_slack_locations_async(discord_ids):
+    """
+    複数の discord_id をまとめて引く (キャッシュと未コミット分で見つからないものだけ DB を1回引く)。
+    Returns:
+        {discord_id (str): (slack_ts, 転送先のチャンネルID)} (対応表にないものは含まない)
+    """
+    rows, missing = {}, []
+    for discord_id in map(str, discord_ids):
+        row = _cached_by_discord(discord_id)
+        if row is _MISSING:
+            missing.append(discord_id)
+        elif row is not None:
+            rows[discord_id] = row
+    if missing:
+        rows.update(await _run_in_db_thread(_query_by_discord_many, missing))
+    return {discord_id: (row.slack_ts, row.slack_channel) for discord_id, row in rows.items()}
+
+async def warm_mapping_cache_async(limit):
+    return await _run_in_db_thread(warm_mapping_cache, limit)
+
+async def delete_mapping_by_slack_async(slack_ts):
+    delete_mapping_by_slack(slack_ts)
+
+async def delete_mapping_by_discord_async(discord_id):
+    delete_mapping_by_discord(discord_id)
+
+# --- 保持期間を過ぎた対応表の削除 (compaction) ---
+
+def _db_file_size(conn):
+    page_size = conn.exec_driver_sql("PRAGMA page_size").scalar()
+    page_count = conn.exec_driver_sql("PRAGMA page_count").scalar()
+    return page_size * page_count
+
+def _delete_expired_batch(retention_days, batch_size):
+    """
+    保持期間を過ぎた行を最大 batch_size 件削除し、キャッシュからも外す
+    (短いトランザクションで書き込みロックを保持しない)
+    """
+    expired = (
+        select(MessageMap.id, MessageMap.slack_ts, MessageMap.discord_id)
+        .where(MessageMap.created_at < func.datetime("now", f"-{int(retention_days)} days"))
+        .order_by(MessageMap.id)
+        .limit(batch_size)
+    )
+    with engine.begin() as conn:
+        rows = conn.execute(expired).all()
+        if rows:
+            conn.execute(MessageMap.__table__.delete().where(MessageMap.id.in_([row.id for row in rows])))
+    # 削除した対応がキャッシュから引けると、消えたメッセージへの編集・削除を転送しようとしてしまう
+    for row in rows:
+        if row.slack_ts is not None:
+            mapping_cache.discard_slack(row.slack_ts)
+        else:
+            mapping_cache.discard_discord(row.discord_id)
+    return len(rows)
+
+def _reclaim_space():
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        before = _db_file_size(conn)
+        # execute() では1ページしか解放されないため、最後まで実行する executescript を使う
+        conn.connection.driver_connection.executescript("PRAGMA incremental_vacuum;")
+        conn.exec_driver_sql("PRAGMA wal_checkpoint(TRUNCATE)").fetchall()
+        return before - _db_file_size(conn)
+
+async def compact_mappings(retention_days=MAPPING_RETENTION_DAYS, batch_size=MAPPING_COMPACTION_BATCH):
+    """
+    retention_days より古い対応表をバッチ単位で削除し、空きページを解放する。
+    Returns:
+        {"rows": 削除した行数, "bytes": 縮小したDBファイルのバイト数}
+    """
+    global last_compaction
+    deleted = 0
+    while True:
+        count = await _run_in_db_thread(_delete_expired_batch, retention_days, batch_size)
+        deleted += count
+        if count < batch_size:
+            break
+        # バッチの間に他の読み書きを実行させる
+        await asyncio.sleep(0)
+    reclaimed = await _run_in_db_thread(_reclaim_space) if engine.dialect.name == "sqlite" else 0
+    last_compaction = {"rows": deleted, "bytes": reclaimed}
+    return last_compaction
+
+async def run_mapping_compaction():
+    """MAPPING_COMPACTION_INTERVAL ごとに compact_mappings を実行するバックグラウンドタスク"""
+    if not MAPPING_RETENTION_DAYS:
+        return
+    while True:
+        try:
+            result = await compact_mappings()
+            logging.info(
+                f"Message mapping compaction: removed {result['rows']} rows, "
+                f"reclaimed {result['bytes'] / 1024:.1f}KB"
+            )
+        except Exception as e:
+            logging.error(f"Message mapping compaction failed: {e}")
+        await asyncio.sleep(MAPPING_COMPACTION_INTERVAL)
+
+# --- 受信イベントの outbox (クラッシュ・障害時に再送するため、処理前に記録する) ---
+
+_outbox = OutboxEntry.__table__
+_outbox_boot_id = None  # init_db の時点の outbox の最大ID
+_dead_letters = DeadLetter.__table__
+
+def _insert_outbox_entry(kind, key, payload):
+    with engine.begin() as conn:
+        result = conn.execute(_outbox.insert().values(kind=kind, key=key, payload=json.dumps(payload), attempts=0))
+        return result.inserted_primary_key[0]
+
+def _record_outbox_attempt(entry_id, attempts, error):
+    with engine.begin() as conn:
+        conn.execute(_outbox.update().where(_outbox.c.id == entry_id).values(attempts=attempts, last_error=error))
+
+def _dead_letter_outbox_entry(entry_id, attempts, error):
+    with engine.begin() as conn:
+        row = conn.execute(select(_outbox).where(_outbox.c.id == entry_id)).first()
+        if row is None:
+            return
+        conn.execute(_dead_letters.insert().values(
+            kind=row.kind, key=row.key, payload=row.payload,
+            attempts=attempts, last_error=error, created_at=row.created_at,
+        ))
+        conn.execute(_outbox.delete().where(_outbox.c.id == entry_id))
+
+def _undelivered_outbox_entries():
+    """前回のプロセスで転送が終わらなかったイベント (init_db の時点で残っていたもの) を記録順に返す"""
+    if _outbox_boot_id is None:
+        return []
+    with engine.connect() as conn:
+        rows = conn.execute(
+            select(_outbox.c.id, _outbox.c.kind, _outbox.c.key, _outbox.c.payload, _outbox.c.attempts)
+            .where(_outbox.c.id <= _outbox_boot_id)
+            .order_by(_outbox.c.id)
+        ).all()
+    return [{**row._mapping, "payload": json.loads(row.payload)} for row in rows]
+
+def _outbox_counts():
+    with engine.connect() as conn:
+        pending = conn.execute(select(func.count()).select_from(_outbox)).scalar()
+        dead = conn.execute(select(func.count()).select_from(_dead_letters)).scalar()
+    return {"pending": pending, "dead": dead}
+
+def _list_dead_letters(limit):
+    with engine.connect() as conn:
+        rows = conn.execute(select(_dead_letters).order_by(_dead_letters.c.id.desc()).limit(limit)).all()
+    return [dict(row._mapping) for row in rows]
+
+def append_outbox_entry_nowait(kind, key, payload):
+    """
+    DBスレッドでイベントの記録を開始し、記録したIDを返す Future を返す。
+    await せずに呼べるので、イベントハンドラの最初の await より前に使える。
+    """
+    loop = asyncio.get_running_loop()
+    return loop.run_in_executor(_db_executor, _insert_outbox_entry, kind, key, payload)
+
+def complete_outbox_entry(entry_id):
+    """
+    転送が終わったイベントを outbox から削除する。転送中に保存した対応表と同じトランザクションで
+    コミットするので、対応表を書き込む前に終了しても、イベントは残って再送される。
+    """
+    write_buffer.complete_outbox(entry_id)
+
+async def record_outbox_attempt_async(entry_id, attempts, error):
+    await _run_in_db_thread(_record_outbox_attempt, entry_id, attempts, error)
+
+async def dead_letter_outbox_entry_async(entry_id, attempts, error):
+    await _run_in_db_thread(_dead_letter_outbox_entry, entry_id, attempts, error)
+
+async def undelivered_outbox_entries_async():
+    return await _run_in_db_thread(_undelivered_outbox_entries)
+
+async def outbox_counts_async():
+    return await _run_in_db_thread(_outbox_counts)
+
+async def list_dead_letters_async(limit=10):
+    return await _run_in_db_thread(_list_dead_letters, limit)
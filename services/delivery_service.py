@@ -0,0 +1,205 @@
+import asyncio
+import heapq
+import logging
+import time
+from collections import deque
+from config import EDIT_COALESCE_WINDOW, EDIT_COALESCE_MAX_DELAY, REACTION_BATCH_WINDOW
+
+def channel_of(key):
+    """delivery_key からスレッドを除いたチャンネルのキー"""
+    return ":".join(key.split(":", 2)[:2])
+
+def delivery_key(platform, channel, thread=None):
+    """送信元のチャンネル (スレッドがあればスレッド) ごとのキー"""
+    if thread:
+        return f"{platform}:{channel}:{thread}"
+    return f"{platform}:{channel}"
+
+class DeliveryScheduler:
+    """
+    送信元チャンネル (スレッド) ごとに、受け取った順でイベントを1件ずつ処理する。
+    異なるチャンネルのイベントは並列に処理する。
+    スレッドのキューの統計は、キューが空になったらチャンネルの統計にまとめる (スレッドの数だけ増えないように)。
+    """
+
+    def __init__(self):
+        self._queues = {}   # key -> deque[(queued_at, job)]
+        self._workers = {}  # key -> asyncio.Task
+        self._stats = {}    # key (処理中のスレッドか、チャンネル) -> {"processed", "total_wait", "max_wait"}
+
+    def submit(self, key, job):
+        """
+        job (引数なしのコルーチン関数) を key のキューに積む。
+        受け取った順を保つため、イベントハンドラの最初の await より前に呼ぶこと。
+        """
+        self._queues.setdefault(key, deque()).append((time.monotonic(), job))
+        if key not in self._workers:
+            self._workers[key] = asyncio.create_task(self._drain(key))
+
+    async def _drain(self, key):
+        queue = self._queues[key]
+        stats = self._stats.setdefault(key, {"processed": 0, "total_wait": 0.0, "max_wait": 0.0})
+        try:
+            while queue:
+                queued_at, job = queue.popleft()
+                wait = time.monotonic() - queued_at
+                stats["total_wait"] += wait
+                stats["max_wait"] = max(stats["max_wait"], wait)
+                try:
+                    await job()
+                except Exception as e:
+                    logging.error(f"Error delivering event from {key}: {e}")
+                stats["processed"] += 1
+        finally:
+            del self._workers[key]
+            if not queue:
+                self._queues.pop(key, None)
+                self._roll_up(key)
+
+    def _roll_up(self, key):
+        channel = channel_of(key)
+        if channel == key:
+            return
+        stats = self._stats.pop(key)
+        total = self._stats.setdefault(channel, {"processed": 0, "total_wait": 0.0, "max_wait": 0.0})
+        total["processed"] += stats["processed"]
+        total["total_wait"] += stats["total_wait"]
+        total["max_wait"] = max(total["max_wait"], stats["max_wait"])
+
+    def stats(self, top=None):
+        """チャンネル (処理中のスレッド) ごとの待ち件数と待ち時間 (top を指定したら待ち件数の多い順に top 件)"""
+        items = self._stats.items()
+        if top is not None:
+            items = heapq.nlargest(top, items, key=lambda item: len(self._queues.get(item[0], ())))
+        return {
+            key: {
+                "depth": len(self._queues.get(key, ())),
+                "processed": s["processed"],
+                "avg_wait": s["total_wait"] / s["processed"] if s["processed"] else 0.0,
+                "max_wait": s["max_wait"],
+            }
+            for key, s in items
+        }
+
+delivery_scheduler = DeliveryScheduler()
+
+class EditCoalescer:
+    """
+    同じメッセージへの連続した編集をまとめる。window 秒間次の編集がなければ最後の編集だけを処理する
+    (編集が続いても最初の編集から max_delay 秒以内には処理する)。削除が来たら保留中の編集は捨てる。
+    """
+
+    def __init__(self, window, max_delay):
+        self.window = window
+        self.max_delay = max_delay
+        self._pending = {}  # key -> (TimerHandle, 最初の編集の時刻, drop)
+        self.received = 0
+        self.applied = 0
+        self.coalesced = 0
+        self.cancelled = 0
+
+    def submit(self, key, job, drop=None):
+        """
+        job (引数なしの関数) を後で実行する。それまでに同じ key の編集が来たら置き換える。
+        drop (引数なしの関数) は job を実行しないことになったときに呼ぶ (置き換え・削除)
+        """
+        self.received += 1
+        if self.window <= 0:
+            self.applied += 1
+            job()
+            return
+        loop = asyncio.get_running_loop()
+        now = loop.time()
+        first_at = now
+        pending = self._pending.pop(key, None)
+        if pending is not None:
+            first_at = pending[1]
+            self._drop(key, pending)
+            self.coalesced += 1
+        delay = max(0.0, min(self.window, first_at + self.max_delay - now))
+        self._pending[key] = (loop.call_later(delay, self._fire, key, job), first_at, drop)
+
+    def _fire(self, key, job):
+        self._pending.pop(key, None)
+        self.applied += 1
+        try:
+            job()
+        except Exception as e:
+            logging.error(f"Error applying coalesced edit for {key}: {e}")
+
+    def cancel(self, key):
+        """削除されたメッセージの保留中の編集を捨てる"""
+        pending = self._pending.pop(key, None)
+        if pending is None:
+            return False
+        self._drop(key, pending)
+        self.cancelled += 1
+        return True
+
+    def _drop(self, key, pending):
+        handle, _, drop = pending
+        handle.cancel()
+        if drop is None:
+            return
+        try:
+            drop()
+        except Exception as e:
+            logging.error(f"Error dropping coalesced edit for {key}: {e}")
+
+    def stats(self):
+        return {
+            "pending": len(self._pending),
+            "received": self.received,
+            "applied": self.applied,
+            "coalesced": self.coalesced,
+            "cancelled": self.cancelled,
+        }
+
+edit_coalescer = EditCoalescer(EDIT_COALESCE_WINDOW, EDIT_COALESCE_MAX_DELAY)
+
+class ReactionBatcher:
+    """
+    メッセージごとにリアクションの追加・削除を window 秒間ためて、まとめて処理する。
+    同じユーザーの同じリアクションへの操作は最後のものだけを残す (付けてすぐ外したものは打ち消される)。
+    """
+
+    def __init__(self, window):
+        self.window = window
+        self._pending = {}  # key -> {(reaction, user): 追加なら True}
+        self.received = 0
+        self.collapsed = 0
+        self.batches = 0
+
+    def submit(self, key, reaction, user, added, flush):
+        """
+        key (メッセージ) の操作をためる。最初の操作から window 秒後に
+        flush(changes) を呼ぶ。changes は {reaction: {user: 追加なら True}}
+        """
+        self.received += 1
+        pending = self._pending.get(key)
+        if pending is None:
+            pending = self._pending[key] = {}
+            asyncio.get_running_loop().call_later(self.window, self._flush, key, flush)
+        if (reaction, user) in pending:
+            self.collapsed += 1
+        pending[(reaction, user)] = added
+
+    def _flush(self, key, flush):
+        changes = {}
+        for (reaction, user), added in self._pending.pop(key, {}).items():
+            changes.setdefault(reaction, {})[user] = added
+        self.batches += 1
+        try:
+            flush(changes)
+        except Exception as e:
+            logging.error(f"Error flushing reactions for {key}: {e}")
+
+    def stats(self):
+        return {
+            "pending": len(self._pending),
+            "received": self.received,
+            "collapsed": self.collapsed,
+            "batches": self.batches,
+        }
+
+reaction_batcher = ReactionBatcher(REACTION_BATCH_WINDOW)
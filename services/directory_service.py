@@ -0,0 +1,43 @@
+import logging
+from slack_sdk.errors import SlackApiError
+from utils.cache import TTLCache
+from config import DIRECTORY_CACHE_SIZE, DIRECTORY_CACHE_TTL, DIRECTORY_NEGATIVE_TTL
+
+# 存在しないIDとして negative cache してよい Slack API のエラー
+_NOT_FOUND_ERRORS = {"user_not_found", "channel_not_found", "not_in_channel"}
+
+# Slack のユーザー / チャンネル情報キャッシュ (slack_bot と discord_bot で共有)
+user_cache = TTLCache(DIRECTORY_CACHE_SIZE, DIRECTORY_CACHE_TTL, DIRECTORY_NEGATIVE_TTL)
+channel_cache = TTLCache(DIRECTORY_CACHE_SIZE, DIRECTORY_CACHE_TTL, DIRECTORY_NEGATIVE_TTL)
+
+async def _call_or_none(method, **kwargs):
+    try:
+        resp = await method(**kwargs)
+    except SlackApiError as e:
+        if e.response.get("error") in _NOT_FOUND_ERRORS:
+            return None
+        raise
+    return resp if resp["ok"] else None
+
+async def get_user_profile(client, user_id):
+    """Slackユーザーのプロフィールを取得 (存在しない場合は None)"""
+    async def loader(user_id):
+        resp = await _call_or_none(client.users_info, user=user_id)
+        if resp is None:
+            logging.info(f"Slack user {user_id} not found")
+            return None
+        return resp["user"].get("profile", {})
+    return await user_cache.get(user_id, loader)
+
+async def get_channel_info(client, channel_id):
+    """Slackチャンネル情報を取得 (存在しない場合は None)"""
+    async def loader(channel_id):
+        resp = await _call_or_none(client.conversations_info, channel=channel_id)
+        if resp is None:
+            logging.info(f"Slack channel {channel_id} not found")
+            return None
+        return resp["channel"]
+    return await channel_cache.get(channel_id, loader)
+
+def directory_stats():
+    return {"users": user_cache.stats(), "channels": channel_cache.stats()}
@@ -0,0 +1,161 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from slack_sdk.errors import SlackApiError
+from config import (
+    SLACK_RATE_PER_CHANNEL, SLACK_BURST_PER_CHANNEL, SLACK_RATE_GLOBAL, SLACK_BURST_GLOBAL,
+    DISCORD_RATE_PER_CHANNEL, DISCORD_BURST_PER_CHANNEL, DISCORD_RATE_GLOBAL, DISCORD_BURST_GLOBAL,
+    OUTBOUND_MAX_RETRIES,
+)
+
+# 優先度 (小さいほど先に送る): 削除・編集は溜まっている投稿より先に反映する
+PRIORITY_DELETE = 0
+PRIORITY_EDIT = 1
+PRIORITY_REACTION = 2
+PRIORITY_POST = 3
+
+class TokenBucket:
+    """rate 件/秒で補充され、最大 burst 件までためられるトークンバケット"""
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+
+    def delay(self):
+        """次のトークンが取れるまでの秒数 (0 なら今すぐ取れる)"""
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if now < self.blocked_until:
+            return self.blocked_until - now
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def take(self):
+        self.tokens -= 1
+
+    def block(self, seconds):
+        """Retry-After を受けたら、その間はトークンを出さない"""
+        self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+        self.tokens = 0.0
+
+def slack_retry_after(e):
+    """Slack の 429 なら (Retry-After 秒, 全体に適用するか) を返す"""
+    if not isinstance(e, SlackApiError) or e.response.status_code != 429:
+        return None
+    headers = e.response.headers or {}
+    retry_after = headers.get("Retry-After") or headers.get("retry-after") or 1
+    return float(retry_after), False
+
+class Dispatcher:
+    """
+    送信先ごとの優先度付きキューとトークンバケットで API 呼び出しを順に実行する。
+    送信先の上限とプラットフォーム全体の上限の両方を守り、retry_after があれば 429 を受けたときに
+    Retry-After だけ待って再送する (discord.py は 429 をライブラリの中で待って再送するので Discord では使わない)。
+    """
+
+    def __init__(self, name, rate, burst, global_rate, global_burst, retry_after=None, max_retries=OUTBOUND_MAX_RETRIES):
+        self.name = name
+        self.rate = rate
+        self.burst = burst
+        self.retry_after = retry_after
+        self.max_retries = max_retries
+        self._global = TokenBucket(global_rate, global_burst)
+        self._buckets = {}  # 送信先 -> TokenBucket
+        self._queues = {}   # 送信先 -> [(priority, seq, queued_at, attempts, call, future)]
+        self._workers = {}  # 送信先 -> asyncio.Task
+        self._seq = itertools.count()
+        self.sent = 0
+        self.failed = 0
+        self.rate_limited = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    async def submit(self, key, call, priority=PRIORITY_POST):
+        """
+        call (コルーチンを返す引数なしの関数) を送信先 key のキューに積み、実行結果を返す。
+        再送のときは call をもう一度呼ぶので、毎回新しいコルーチンを作ること。
+        """
+        future = asyncio.get_running_loop().create_future()
+        job = (priority, next(self._seq), time.monotonic(), 0, call, future)
+        heapq.heappush(self._queues.setdefault(key, []), job)
+        if key not in self._workers:
+            self._workers[key] = asyncio.create_task(self._drain(key))
+        return await future
+
+    async def _acquire(self, bucket):
+        while True:
+            delay = max(bucket.delay(), self._global.delay())
+            if delay <= 0:
+                bucket.take()
+                self._global.take()
+                return
+            await asyncio.sleep(delay)
+
+    async def _drain(self, key):
+        queue = self._queues[key]
+        bucket = self._buckets.setdefault(key, TokenBucket(self.rate, self.burst))
+        try:
+            while queue:
+                priority, seq, queued_at, attempts, call, future = heapq.heappop(queue)
+                if future.done():  # 呼び出し元がキャンセル済み
+                    continue
+                await self._acquire(bucket)
+                if future.done():
+                    continue
+                try:
+                    result = await call()
+                except Exception as e:
+                    limited = self.retry_after(e) if self.retry_after else None
+                    if limited is None or attempts >= self.max_retries:
+                        self.failed += 1
+                        if not future.done():
+                            future.set_exception(e)
+                        continue
+                    retry_after, is_global = limited
+                    self.rate_limited += 1
+                    logging.warning(f"{self.name}: rate limited on {key}, retrying in {retry_after:.1f}s")
+                    (self._global if is_global else bucket).block(retry_after)
+                    # 同じ優先度・順番のまま積み直す
+                    heapq.heappush(queue, (priority, seq, queued_at, attempts + 1, call, future))
+                    continue
+                wait = time.monotonic() - queued_at
+                self.sent += 1
+                self.total_wait += wait
+                self.max_wait = max(self.max_wait, wait)
+                if not future.done():
+                    future.set_result(result)
+        finally:
+            del self._workers[key]
+            if not queue:
+                self._queues.pop(key, None)
+
+    def stats(self):
+        stats = {
+            "queued": sum(len(queue) for queue in self._queues.values()),
+            "destinations": len(self._workers),
+            "sent": self.sent,
+            "failed": self.failed,
+            "avg_wait": self.total_wait / self.sent if self.sent else 0.0,
+            "max_wait": self.max_wait,
+        }
+        # 429 を自分で処理しないもの (Discord) は数えられないので出さない
+        if self.retry_after:
+            stats["rate_limited"] = self.rate_limited
+        return stats
+
+slack_dispatcher = Dispatcher(
+    "slack", SLACK_RATE_PER_CHANNEL, SLACK_BURST_PER_CHANNEL, SLACK_RATE_GLOBAL, SLACK_BURST_GLOBAL, slack_retry_after,
+)
+discord_dispatcher = Dispatcher(
+    "discord", DISCORD_RATE_PER_CHANNEL, DISCORD_BURST_PER_CHANNEL, DISCORD_RATE_GLOBAL, DISCORD_BURST_GLOBAL,
+)
+
+def dispatch_stats():
+    return {"slack": slack_dispatcher.stats(), "discord": discord_dispatcher.stats()}
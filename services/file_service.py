@@ -1,4 +1,23 @@
+import asyncio
+import hashlib
+import json
+import logging
 import os
+import tempfile
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from services.http_service import get_http_session
+from config import (
+    MAX_FILE_SIZE, FILE_CHUNK_SIZE, FILE_SPOOL_MEMORY_LIMIT,
+    ATTACHMENT_CONCURRENCY, ATTACHMENT_BYTES_IN_FLIGHT, ATTACHMENT_TIMEOUT,
+    ATTACHMENT_CACHE_DIR, ATTACHMENT_CACHE_MAX_BYTES, ATTACHMENT_INDEX_SAVE_DELAY,
+)
+
+class TransferError(Exception):
+    """添付ファイルの転送に失敗した"""
+
+class FileTooLargeError(TransferError):
+    """MAX_FILE_SIZE を超えるファイル"""
 
 def upload_file(file_path, platform):
     """
@@ -8,3 +27,300 @@ def upload_file(file_path, platform):
         print(f"Slack に {file_path} をアップロード")
     elif platform == "discord":
         print(f"Discord に {file_path} をアップロード")
+
+async def iter_download(url, headers=None, max_size=MAX_FILE_SIZE):
+    """
+    ファイルをチャンク単位でダウンロードする。
+    Content-Length と受信済みバイト数の両方でサイズ上限を確認し、超えた時点で中断する。
+    """
+    session = get_http_session()
+    async with session.get(url, headers=headers) as resp:
+        if resp.status != 200:
+            raise TransferError(f"Download failed with status {resp.status}")
+        if resp.content_length is not None and resp.content_length > max_size:
+            raise FileTooLargeError(f"ファイルサイズが大きすぎます: {resp.content_length} bytes")
+        received = 0
+        async for chunk in resp.content.iter_chunked(FILE_CHUNK_SIZE):
+            received += len(chunk)
+            if received > max_size:
+                raise FileTooLargeError(f"ファイルサイズが大きすぎます: {received} bytes 以上")
+            yield chunk
+
+async def download_to_spool(url, headers=None, max_size=MAX_FILE_SIZE):
+    """
+    ダウンロードした内容を SpooledTemporaryFile に書き込んで返す (先頭に seek 済み)。
+    FILE_SPOOL_MEMORY_LIMIT を超えた分はメモリではなく一時ファイルに書き出される。
+    """
+    spool = tempfile.SpooledTemporaryFile(max_size=FILE_SPOOL_MEMORY_LIMIT)
+    try:
+        async for chunk in iter_download(url, headers=headers, max_size=max_size):
+            spool.write(chunk)
+    except BaseException:
+        spool.close()
+        raise
+    spool.seek(0)
+    return spool
+
+async def upload_chunks(chunks, dest_url, length):
+    """非同期イテレータ chunks の内容をそのまま dest_url に POST する (Slack の upload_url 用)"""
+    session = get_http_session()
+    headers = {"Content-Type": "application/octet-stream", "Content-Length": str(length)}
+    async with session.post(dest_url, data=chunks, headers=headers) as resp:
+        if resp.status != 200:
+            raise TransferError(f"Upload failed with status {resp.status}")
+
+class ByteBudget:
+    """プロセス全体で同時に転送中のバイト数を limit 以下に抑える"""
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.in_flight = 0
+        self._cond = asyncio.Condition()
+
+    @asynccontextmanager
+    async def reserve(self, size):
+        # limit より大きいファイルも、他に転送中のものがなければ通す
+        size = min(size, self.limit)
+        async with self._cond:
+            await self._cond.wait_for(lambda: self.in_flight + size <= self.limit)
+            self.in_flight += size
+        try:
+            yield
+        finally:
+            async with self._cond:
+                self.in_flight -= size
+                self._cond.notify_all()
+
+transfer_budget = ByteBudget(ATTACHMENT_BYTES_IN_FLIGHT)
+_transfer_slots = asyncio.Semaphore(ATTACHMENT_CONCURRENCY)
+
+async def transfer_all(items, transfer, size_of):
+    """
+    items の各要素に transfer(item) を並列に実行する。
+    同時実行数は ATTACHMENT_CONCURRENCY、転送中の合計サイズは ATTACHMENT_BYTES_IN_FLIGHT、
+    1件あたりの時間は ATTACHMENT_TIMEOUT 秒までに制限する。1件の失敗は他に影響しない。
+
+    Returns:
+        (成功した transfer の戻り値のリスト (items の順), 失敗した [(item, 例外)])
+    """
+    async def run(item):
+        async with _transfer_slots:
+            async with transfer_budget.reserve(size_of(item)):
+                return await asyncio.wait_for(transfer(item), ATTACHMENT_TIMEOUT)
+
+    results = await asyncio.gather(*(run(item) for item in items), return_exceptions=True)
+    succeeded, failed = [], []
+    for item, result in zip(items, results):
+        if isinstance(result, BaseException):
+            if isinstance(result, asyncio.TimeoutError):
+                result = TransferError(f"Timed out after {ATTACHMENT_TIMEOUT}s")
+            failed.append((item, result))
+        else:
+            succeeded.append(result)
+    return succeeded, failed
+
+class AttachmentCache:
+    """
+    SHA-256 をキーにしたディスク上の添付ファイルキャッシュ (LRU, 合計サイズ上限付き)。
+
+    - sources: 転送元のファイル ("slack:<file id>" / "discord:<attachment id>") → SHA-256
+    - destinations: SHA-256 → 転送先チャンネルごとの、共有済みの Slack ファイルID
+    同じファイル (同じID) が再び転送されるときはダウンロードを省略する。IDが違っても内容が同じなら
+    (ダウンロードして SHA-256 を計算した後) 同じ Slack チャンネルには再アップロードせず共有済みのファイルを使う。別のチャンネルでは読めない (非公開チャンネルなど) ことがあるので使い回さない。
+    Discord の添付URLは元のメッセージが消えると無効になるので記録せず、キャッシュからアップロードし直す。
+    ファイルの読み書きは別スレッドで行い、索引の保存は ATTACHMENT_INDEX_SAVE_DELAY 秒ごとにまとめる。
+    """
+
+    INDEX_FILE = "index.json"
+
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._blobs = OrderedDict()  # sha -> size (LRU 順)
+        self._sources = {}           # source key -> sha
+        self._destinations = {}      # sha -> {"slack": {channel: file_id}}
+        self.total_bytes = 0
+        self.download_skips = 0
+        self.upload_skips = 0
+        self.bytes_saved = 0
+        self._save_handle = None     # 索引の保存の予約 (loop.call_later)
+        self._save_lock = asyncio.Lock()
+        if self.enabled:
+            os.makedirs(directory, exist_ok=True)
+            self._load_index()
+
+    @property
+    def enabled(self):
+        return self.max_bytes > 0
+
+    def _index_path(self):
+        return os.path.join(self.directory, self.INDEX_FILE)
+
+    def blob_path(self, sha):
+        return os.path.join(self.directory, sha)
+
+    def _load_index(self):
+        try:
+            with open(self._index_path(), "r", encoding="utf-8") as f:
+                index = json.load(f)
+        except FileNotFoundError:
+            return
+        except (OSError, json.JSONDecodeError) as e:
+            logging.error(f"添付ファイルキャッシュの索引の読み込みに失敗: {e}")
+            return
+        for sha, size in index.get("blobs", []):
+            if os.path.exists(self.blob_path(sha)):
+                self._blobs[sha] = size
+                self.total_bytes += size
+        self._sources = {k: v for k, v in index.get("sources", {}).items() if v in self._blobs}
+        self._destinations = {
+            sha: {"slack": refs["slack"]}
+            for sha, refs in index.get("destinations", {}).items()
+            # 以前の形式 (チャンネルを区別しない) の記録は使わない
+            if sha in self._blobs and isinstance(refs.get("slack"), dict)
+        }
+
+    def _snapshot_index(self):
+        return {
+            "blobs": list(self._blobs.items()),
+            "sources": dict(self._sources),
+            "destinations": {
+                sha: {platform: dict(refs) for platform, refs in platforms.items()}
+                for sha, platforms in self._destinations.items()
+            },
+        }
+
+    def _write_index(self, index):
+        tmp_path = self._index_path() + ".tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(index, f)
+            os.replace(tmp_path, self._index_path())
+        except OSError as e:
+            logging.error(f"添付ファイルキャッシュの索引の保存に失敗: {e}")
+
+    def _save_index(self):
+        """索引の保存を予約する (ATTACHMENT_INDEX_SAVE_DELAY 秒の間の変更をまとめて1回で書き込む)"""
+        if self._save_handle is None:
+            self._save_handle = asyncio.get_running_loop().call_later(
+                ATTACHMENT_INDEX_SAVE_DELAY, lambda: asyncio.ensure_future(self._flush_index())
+            )
+
+    async def _flush_index(self):
+        self._save_handle = None
+        async with self._save_lock:
+            await asyncio.to_thread(self._write_index, self._snapshot_index())
+
+    def save_index(self):
+        """予約中の索引の保存をすぐに行う (終了時に呼ぶ)"""
+        if self._save_handle is None:
+            return
+        self._save_handle.cancel()
+        self._save_handle = None
+        self._write_index(self._snapshot_index())
+
+    def lookup(self, source_key):
+        """転送元に対応するキャッシュ済みファイルの SHA-256 (なければ None = ダウンロードが必要)"""
+        sha = self._sources.get(source_key)
+        if sha is None or sha not in self._blobs:
+            return None
+        self._blobs.move_to_end(sha)
+        self.download_skips += 1
+        self.bytes_saved += self._blobs[sha]
+        return sha
+
+    def open_blob(self, sha):
+        return open(self.blob_path(sha), "rb")
+
+    def iter_blob(self, sha):
+        # 呼び出し時点で開いておき、読み出し中に LRU で削除されても読めるようにする
+        f = self.open_blob(sha)
+
+        async def chunks():
+            with f:
+                while chunk := await asyncio.to_thread(f.read, FILE_CHUNK_SIZE):
+                    yield chunk
+        return chunks()
+
+    async def fetch(self, source_key, chunks):
+        """
+        chunks を最後まで読み込んでキャッシュに保存し、SHA-256 を返す。
+        キャッシュが有効なときはここで保存してからアップロードする (ダウンロードしながらそのまま
+        アップロードするのはキャッシュが無効なときだけ)
+        """
+        digest = hashlib.sha256()
+        size = 0
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".part")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                async for chunk in chunks:
+                    digest.update(chunk)
+                    size += len(chunk)
+                    await asyncio.to_thread(f.write, chunk)
+            sha = digest.hexdigest()
+            await self._commit(source_key, sha, size, tmp_path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        return sha
+
+    async def _commit(self, source_key, sha, size, tmp_path):
+        if sha in self._blobs:
+            self._blobs.move_to_end(sha)
+        else:
+            await asyncio.to_thread(os.replace, tmp_path, self.blob_path(sha))
+            if sha not in self._blobs:
+                self._blobs[sha] = size
+                self.total_bytes += size
+        self._sources[source_key] = sha
+        evicted = self._evict()
+        if evicted:
+            await asyncio.to_thread(self._remove_blobs, evicted)
+        self._save_index()
+
+    def _evict(self):
+        """上限を超えた分を LRU 順に索引から外し、削除するファイルの SHA-256 を返す"""
+        evicted = []
+        while self.total_bytes > self.max_bytes and len(self._blobs) > 1:
+            sha, size = self._blobs.popitem(last=False)
+            self.total_bytes -= size
+            self._destinations.pop(sha, None)
+            evicted.append(sha)
+        if evicted:
+            self._sources = {k: v for k, v in self._sources.items() if v in self._blobs}
+        return evicted
+
+    def _remove_blobs(self, shas):
+        for sha in shas:
+            try:
+                os.remove(self.blob_path(sha))
+            except OSError as e:
+                logging.error(f"添付ファイルキャッシュの削除に失敗: {e}")
+
+    def get_destination(self, sha, platform, channel):
+        """channel に共有済みのファイル (Slack のファイルID。なければ None)"""
+        ref = self._destinations.get(sha, {}).get(platform, {}).get(channel)
+        if ref is None:
+            return None
+        self.upload_skips += 1
+        self.bytes_saved += self._blobs.get(sha, 0)
+        return ref
+
+    def set_destination(self, source_key, platform, channel, ref):
+        sha = self._sources.get(source_key)
+        if sha is None or sha not in self._blobs:
+            return
+        self._destinations.setdefault(sha, {}).setdefault(platform, {})[channel] = ref
+        self._save_index()
+
+    def stats(self):
+        return {
+            "files": len(self._blobs),
+            "bytes": self.total_bytes,
+            "max_bytes": self.max_bytes,
+            "download_skips": self.download_skips,
+            "upload_skips": self.upload_skips,
+            "bytes_saved": self.bytes_saved,
+        }
+
+attachment_cache = AttachmentCache(ATTACHMENT_CACHE_DIR, ATTACHMENT_CACHE_MAX_BYTES)
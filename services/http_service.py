@@ -0,0 +1,35 @@
+import aiohttp
+import logging
+from config import HTTP_POOL_LIMIT, HTTP_POOL_LIMIT_PER_HOST, HTTP_DNS_CACHE_TTL, HTTP_KEEPALIVE_TIMEOUT, HTTP_TIMEOUT
+
+_session = None
+
+def get_http_session() -> aiohttp.ClientSession:
+    """
+    アプリ全体で共有する aiohttp.ClientSession を返す。
+    コネクションプール・keep-alive・DNS キャッシュを全ての外部HTTP通信で使い回す。
+    """
+    global _session
+    if _session is None or _session.closed:
+        connector = aiohttp.TCPConnector(
+            limit=HTTP_POOL_LIMIT,
+            limit_per_host=HTTP_POOL_LIMIT_PER_HOST,
+            ttl_dns_cache=HTTP_DNS_CACHE_TTL,
+            keepalive_timeout=HTTP_KEEPALIVE_TIMEOUT,
+        )
+        _session = aiohttp.ClientSession(
+            connector=connector,
+            timeout=aiohttp.ClientTimeout(total=HTTP_TIMEOUT),
+        )
+        logging.info("Created shared HTTP session")
+    return _session
+
+def attach_http_session(slack_client):
+    """Slack の AsyncWebClient にも共有セッションを使わせる (リクエストごとのセッション作成を避ける)"""
+    slack_client.session = get_http_session()
+
+async def close_http_session():
+    global _session
+    if _session is not None and not _session.closed:
+        await _session.close()
+    _session = None
@@ -3,6 +3,7 @@ import aiohttp
 from datetime import datetime, timedelta
 import discord
 from config import NEWS_API_KEY, NEWS_KEYWORDS, DISCORD_NEWS_CHANNEL_ID
+from services.http_service import get_http_session
 import logging
 
 class NewsService:
@@ -37,34 +38,34 @@ class NewsService:
                     "pageSize": 5
                 }
 
-            async with aiohttp.ClientSession(timeout=self.timeout) as session:
-                async with session.get(endpoint, headers=self.headers, params=params) as response:
-                    if response.status == 200:
-                        data = await response.json()
-                        articles = data.get("articles", [])
+            session = get_http_session()
+            async with session.get(endpoint, headers=self.headers, params=params, timeout=self.timeout) as response:
+                if response.status == 200:
+                    data = await response.json()
+                    articles = data.get("articles", [])
                         
-                        if not articles and not fallback:
-                            return await self.fetch_news(fallback=True)
+                    if not articles and not fallback:
+                        return await self.fetch_news(fallback=True)
                         
-                        if not articles:
-                            # デフォルトニュースの配列を返す
-                            return [{
-                                "title": "AIと機械学習の最新動向",
-                                "description": "最新のAI技術動向とその応用について解説します。",
-                                "url": "https://github.com/paraccoli",
-                                "urlToImage": "https://i.pinimg.com/736x/71/d7/f0/71d7f0358952998072b0d92de58c8257.jpg",
-                                "source": {"name": "研究室Bot News"},
-                                "publishedAt": datetime.now().isoformat()
-                            }]
+                    if not articles:
+                        # デフォルトニュースの配列を返す
+                        return [{
+                            "title": "AIと機械学習の最新動向",
+                            "description": "最新のAI技術動向とその応用について解説します。",
+                            "url": "https://github.com/paraccoli",
+                            "urlToImage": "https://i.pinimg.com/736x/71/d7/f0/71d7f0358952998072b0d92de58c8257.jpg",
+                            "source": {"name": "研究室Bot News"},
+                            "publishedAt": datetime.now().isoformat()
+                        }]
                         
-                        return articles
+                    return articles
 
-                    elif response.status == 429:
-                        logging.error("NewsAPI rate limit exceeded")
-                        return self.get_default_articles()
-                    else:
-                        logging.error(f"NewsAPI Error: Status {response.status}")
-                        return [] if fallback else await self.fetch_news(fallback=True)
+                elif response.status == 429:
+                    logging.error("NewsAPI rate limit exceeded")
+                    return self.get_default_articles()
+                else:
+                    logging.error(f"NewsAPI Error: Status {response.status}")
+                    return [] if fallback else await self.fetch_news(fallback=True)
 
         except Exception as e:
             logging.error(f"ニュース取得エラー: {str(e)}")
@@ -0,0 +1,164 @@
+import asyncio
+import logging
+import random
+import aiohttp
+import discord
+from slack_sdk.errors import SlackApiError
+from sqlalchemy.exc import OperationalError
+from services.database_service import (
+    append_outbox_entry_nowait, complete_outbox_entry, record_outbox_attempt_async,
+    dead_letter_outbox_entry_async, undelivered_outbox_entries_async, outbox_counts_async,
+)
+from services.delivery_service import delivery_scheduler
+from config import OUTBOX_MAX_ATTEMPTS, OUTBOX_BACKOFF_BASE, OUTBOX_BACKOFF_MAX
+
+# 一時的なエラーとして返ってくる Slack API のエラーコード
+_SLACK_TRANSIENT_ERRORS = {"ratelimited", "internal_error", "fatal_error", "service_unavailable", "request_timeout"}
+
+def is_transient_error(e):
+    """再送すれば通りうるエラーか (通信エラー・タイムアウト・5xx・レート制限・DB のロック)"""
+    if isinstance(e, (aiohttp.ClientError, asyncio.TimeoutError, ConnectionError, OperationalError)):
+        return True
+    if isinstance(e, SlackApiError):
+        status = e.response.status_code
+        return status == 429 or status >= 500 or e.response.get("error") in _SLACK_TRANSIENT_ERRORS
+    if isinstance(e, discord.HTTPException):
+        return e.status == 429 or e.status >= 500
+    return False
+
+def backoff_delay(attempts):
+    """attempts 回失敗した後の再送までの秒数 (指数バックオフ + ジッター)"""
+    delay = min(OUTBOX_BACKOFF_MAX, OUTBOX_BACKOFF_BASE * 2 ** (attempts - 1))
+    return random.uniform(delay / 2, delay)
+
+class Outbox:
+    """
+    受信イベントを処理前に SQLite の outbox に記録し、転送が終わったら削除する。
+    一時的なエラーで失敗したイベントは同じキー (チャンネル・スレッド) のキューの中で指数バックオフで待って再送し、
+    その間は同じキーの後のイベントを待たせる (受け取った順を保ち、まだ転送していない投稿への編集・削除を捨てない)。
+    OUTBOX_MAX_ATTEMPTS 回失敗したら、再送しても同じ結果になるエラーならすぐに dead_letters に移す。
+    再起動後は未完了のイベントを記録順に、新しいイベントより先に再送する (at-least-once)。
+    重複しないかは各 handler が対応表で確認する。
+    """
+
+    def __init__(self):
+        self._handlers = {}  # kind -> async handler(payload, live)
+        self._held = []      # 前回の未完了分を積むまで待たせる新しいイベント [(key, job)]
+        self.delivered = 0
+        self.retried = 0
+        self.dead = 0
+
+    def handler(self, kind):
+        """
+        kind のイベントを処理する関数を登録するデコレータ。
+        handler(payload, live) の live は受信したオブジェクト (再送時は None)。失敗したら例外を投げること。
+        """
+        def register(func):
+            self._handlers[kind] = func
+            return func
+        return register
+
+    def enqueue(self, kind, key, payload, live=None):
+        """
+        イベントを記録し、送信元 key の順番で処理する (await しないので最初の await より前に呼ぶ)。
+        記録したIDを返す Future を返す (記録してから受信を確定したいときは await する)
+        """
+        saved = self.record(kind, key, payload)
+        self.schedule(saved, kind, key, payload, live)
+        return saved
+
+    def record(self, kind, key, payload):
+        """イベントを記録だけする (後で schedule で処理するか discard で捨てる)。記録したIDを返す Future を返す"""
+        return append_outbox_entry_nowait(kind, key, payload)
+
+    def schedule(self, saved, kind, key, payload, live=None):
+        """record したイベントを送信元 key の順番で処理する"""
+        job = lambda: self._deliver_new(saved, kind, payload, live)
+        if self._held is not None:
+            self._held.append((key, job))
+        else:
+            delivery_scheduler.submit(key, job)
+
+    def discard(self, saved):
+        """record したが処理しないイベント (後の編集にまとめられたものなど) を outbox から消す"""
+        saved.add_done_callback(_complete_saved)
+
+    async def _deliver_new(self, saved, kind, payload, live):
+        try:
+            entry_id = await saved
+        except Exception as e:
+            # 記録に失敗しても転送は試みる (再送はできない)
+            logging.error(f"Failed to record {kind} event in outbox: {e}")
+            entry_id = None
+        await self._attempt(entry_id, kind, payload, live, 0)
+
+    async def _attempt(self, entry_id, kind, payload, live, attempts):
+        """転送できるか dead_letters に移すまで、このキーのキューを占有して再送する"""
+        while True:
+            try:
+                await self._handlers[kind](payload, live)
+            except Exception as e:
+                attempts += 1
+                error = f"{type(e).__name__}: {e}"
+                if entry_id is None:
+                    logging.error(f"Failed to deliver {kind} event: {error}")
+                    return
+                if attempts >= OUTBOX_MAX_ATTEMPTS or not is_transient_error(e):
+                    # 再送しても同じ結果になるエラーで後のイベントを待たせない
+                    self.dead += 1
+                    logging.error(f"Moved {kind} event {entry_id} to dead letters after {attempts} attempts: {error}")
+                    await dead_letter_outbox_entry_async(entry_id, attempts, error)
+                    return
+                self.retried += 1
+                delay = backoff_delay(attempts)
+                logging.warning(f"Failed to deliver {kind} event {entry_id} (attempt {attempts}), retrying in {delay:.0f}s: {error}")
+                await record_outbox_attempt_async(entry_id, attempts, error)
+                await asyncio.sleep(delay)
+                # 再送時は最新の状態を取得し直す
+                live = None
+                continue
+            self.delivered += 1
+            if entry_id is not None:
+                complete_outbox_entry(entry_id)
+            return
+
+    async def run(self, ready=None):
+        """
+        前回終了時に未完了だったイベントを記録順に再送する。
+        ready: 再送を始める前に待つコルーチン関数 (Discord の接続完了など)。
+        同じキーの新しいイベントより先にキューに積み、ready は各イベントの処理の前に待つ。
+        """
+        try:
+            entries = await undelivered_outbox_entries_async()
+        except Exception as e:
+            logging.error(f"Failed to read undelivered events from outbox: {e}")
+            entries = []
+        ready_task = asyncio.ensure_future(ready()) if ready is not None else None
+        if entries:
+            logging.info(f"Replaying {len(entries)} undelivered events from outbox")
+        for entry in entries:
+            if entry["kind"] not in self._handlers:
+                logging.error(f"No outbox handler for {entry['kind']} (event {entry['id']})")
+                await dead_letter_outbox_entry_async(entry["id"], entry["attempts"], "no handler")
+                continue
+            delivery_scheduler.submit(entry["key"], lambda entry=entry: self._replay(entry, ready_task))
+        # 待たせていた新しいイベントを、前回の未完了分の後ろに積む
+        held, self._held = self._held, None
+        for key, job in held:
+            delivery_scheduler.submit(key, job)
+
+    async def _replay(self, entry, ready_task):
+        if ready_task is not None:
+            await asyncio.shield(ready_task)
+        await self._attempt(entry["id"], entry["kind"], entry["payload"], None, entry["attempts"])
+
+    async def stats(self):
+        counts = await outbox_counts_async()
+        return {**counts, "delivered": self.delivered, "retried": self.retried, "dead_this_run": self.dead}
+
+def _complete_saved(saved):
+    if saved.cancelled() or saved.exception() is not None:
+        return
+    complete_outbox_entry(saved.result())
+
+outbox = Outbox()
@@ -0,0 +1,191 @@
+import asyncio
+import json
+import logging
+import os
+from config import ROUTES_FILE, ROUTES_RELOAD_INTERVAL, NOFW, STOD, DTOS
+
+DIRECTIONS = {
+    "both": (("slack", "discord"), ("discord", "slack")),
+    "slack_to_discord": (("slack", "discord"),),
+    "discord_to_slack": (("discord", "slack"),),
+}
+
+def channel_key(platform, channel):
+    """チャンネルIDの型をそろえる (Discord は int, Slack は str)"""
+    return int(channel) if platform == "discord" else str(channel)
+
+class Route:
+    """
+    source のチャンネルから target のチャンネルへの1方向の転送経路。
+    送信元ごとに最初の経路が primary で、対応表に記録して編集・削除・リアクションも同期する。
+    2つ目以降の経路は新しいメッセージだけを転送する (対応表は1メッセージにつき1件のため)。
+    """
+    __slots__ = ("platform", "source", "target", "nofw", "prefix", "primary")
+
+    def __init__(self, platform, source, target, nofw=NOFW, prefix=None, primary=True):
+        self.platform = platform
+        self.source = source
+        self.target = target
+        self.nofw = nofw
+        self.prefix = prefix
+        self.primary = primary
+
+    def apply(self, text):
+        """この経路で転送する本文 (転送しないなら None)。prefix があれば取り除く"""
+        if self.nofw and self.nofw in text:
+            return None
+        if self.prefix:
+            if not text.startswith(self.prefix):
+                return None
+            return text[len(self.prefix):].lstrip()
+        return text
+
+    def __repr__(self):
+        return f"Route({self.platform}:{self.source} -> {self.target}, primary={self.primary})"
+
+class RoutingTable:
+    """送信元チャンネルから経路を引く表 (作った後は変更しない。再読み込み時は丸ごと差し替える)"""
+
+    def __init__(self, routes=()):
+        self._routes = {}  # (platform, channel) -> tuple[Route]
+        seen = set()
+        for route in routes:
+            key = (route.platform, route.source)
+            if (key, route.target) in seen:
+                continue
+            seen.add((key, route.target))
+            route.primary = key not in self._routes
+            self._routes[key] = self._routes.get(key, ()) + (route,)
+
+    @classmethod
+    def from_bridges(cls, bridges):
+        """
+        bridges: [{"slack": チャンネルID, "discord": チャンネルID,
+                   "direction": "both" | "slack_to_discord" | "discord_to_slack" (省略時 both),
+                   "nofw": 転送しない目印 (省略時 NOFW, null で無効), "prefix": この文字列で始まるものだけ転送}]
+        """
+        routes = []
+        for i, bridge in enumerate(bridges):
+            direction = bridge.get("direction", "both")
+            if direction not in DIRECTIONS:
+                raise ValueError(f"bridges[{i}]: unknown direction {direction!r}")
+            if "slack" not in bridge or "discord" not in bridge:
+                raise ValueError(f"bridges[{i}]: both 'slack' and 'discord' are required")
+            for source, target in DIRECTIONS[direction]:
+                routes.append(Route(
+                    source,
+                    channel_key(source, bridge[source]),
+                    channel_key(target, bridge[target]),
+                    nofw=bridge.get("nofw", NOFW),
+                    prefix=bridge.get("prefix") or None,
+                ))
+        return cls(routes)
+
+    @classmethod
+    def from_file(cls, path):
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+        return cls.from_bridges(data.get("bridges", []))
+
+    @classmethod
+    def from_config(cls):
+        """ROUTES_FILE がないときの既定の経路 (config の STOD / DTOS)"""
+        return cls.from_bridges(
+            [{"slack": s, "discord": d, "direction": "slack_to_discord"} for s, d in STOD.items()]
+            + [{"slack": s, "discord": d, "direction": "discord_to_slack"} for d, s in DTOS.items()]
+        )
+
+    def __len__(self):
+        return sum(len(routes) for routes in self._routes.values())
+
+    def routes_from(self, platform, channel):
+        """channel から出る経路 (primary が先頭。転送対象でなければ空)"""
+        return self._routes.get((platform, channel), ())
+
+    def primary(self, platform, channel):
+        """編集・削除・リアクションを同期する経路 (なければ None)"""
+        routes = self._routes.get((platform, channel))
+        return routes[0] if routes else None
+
+    def forwards(self, platform, channel, text):
+        """text がどれかの経路で転送されるか"""
+        return any(route.apply(text) is not None for route in self._routes.get((platform, channel), ()))
+
+    def channels(self, platform):
+        """platform 側で連携しているチャンネル (転送元・転送先の両方)"""
+        channels = {}
+        for (source_platform, source), routes in self._routes.items():
+            if source_platform == platform:
+                channels[source] = None
+            else:
+                channels.update(dict.fromkeys(route.target for route in routes))
+        return list(channels)
+
+class Router:
+    """
+    ROUTES_FILE から経路表を読み込み、ファイルが変更されたら読み込み直して差し替える
+    (Slack / Discord の接続はそのまま)。読み込みに失敗したら前の経路表を使い続ける。
+    起動時の読み込みに失敗したときは config の経路 (STOD / DTOS) を使う。
+    """
+
+    def __init__(self, path=ROUTES_FILE):
+        self.path = path
+        self.table = RoutingTable()
+        self.source = None  # 今の経路表の読み込み元 (path または "config")
+        self._mtime = False  # 読み込んだファイルの更新時刻 (ファイルがなければ None)
+        self.reloads = 0
+        self.failures = 0
+        self.reload()
+
+    def routes_from(self, platform, channel):
+        return self.table.routes_from(platform, channel)
+
+    def primary(self, platform, channel):
+        return self.table.primary(platform, channel)
+
+    def forwards(self, platform, channel, text):
+        return self.table.forwards(platform, channel, text)
+
+    def reload(self):
+        """ファイルが変わっていれば読み込み直す。差し替えたら True"""
+        try:
+            mtime = os.stat(self.path).st_mtime
+        except FileNotFoundError:
+            mtime = None
+        if mtime == self._mtime:
+            return False
+        source = self.path if mtime is not None else "config"
+        try:
+            table = RoutingTable.from_file(self.path) if mtime is not None else RoutingTable.from_config()
+        except Exception as e:
+            self.failures += 1
+            self._mtime = mtime
+            if self.source is not None:
+                logging.error(f"Failed to load routes from {self.path}, keeping {len(self.table)} routes: {e}")
+                return False
+            # 空の経路表のまま何も転送せずに動き続けないよう、起動時は config の経路を使う
+            logging.error(f"Failed to load routes from {self.path}, falling back to config routes: {e}")
+            table, source = RoutingTable.from_config(), "config"
+        self.table, self._mtime, self.source = table, mtime, source
+        self.reloads += 1
+        logging.info(f"Loaded {len(table)} routes from {source}")
+        return True
+
+    async def run_reload(self, interval=ROUTES_RELOAD_INTERVAL):
+        """interval 秒ごとに ROUTES_FILE の変更を確認する"""
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                self.reload()
+            except Exception as e:
+                logging.error(f"Failed to reload routes: {e}")
+
+    def stats(self):
+        return {
+            "routes": len(self.table),
+            "source": self.source,
+            "reloads": self.reloads,
+            "failures": self.failures,
+        }
+
+router = Router()
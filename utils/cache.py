@@ -0,0 +1,175 @@
+import asyncio
+import time
+from collections import OrderedDict
+
+_MISSING = object()
+
+def _retrieve_exception(task):
+    # 待機者がすべてキャンセルされた場合の "exception was never retrieved" を防ぐ
+    if not task.cancelled():
+        task.exception()
+
+class TTLCache:
+    """
+    TTL付きのLRUキャッシュ。
+
+    - maxsize を超えると最も古く使われたエントリから削除
+    - ローダーが None を返した場合は negative_ttl の間だけ「存在しない」ことをキャッシュ
+    - 同じキーへの同時ルックアップは1回のローダー呼び出しにまとめる (single-flight)
+    """
+
+    def __init__(self, maxsize=1024, ttl=3600, negative_ttl=300):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self._data = OrderedDict()  # key -> (expires_at, value)
+        self._inflight = {}         # key -> asyncio.Future
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return self._lookup(key) is not _MISSING
+
+    def _lookup(self, key):
+        entry = self._data.get(key)
+        if entry is None:
+            return _MISSING
+        expires_at, value = entry
+        if expires_at <= time.monotonic():
+            del self._data[key]
+            return _MISSING
+        self._data.move_to_end(key)
+        return value
+
+    def set(self, key, value):
+        ttl = self.ttl if value is not None else self.negative_ttl
+        self._data[key] = (time.monotonic() + ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def invalidate(self, key):
+        self._data.pop(key, None)
+
+    def clear(self):
+        self._data.clear()
+
+    async def get(self, key, loader):
+        """
+        キャッシュから値を取得し、なければ loader(key) を await して格納する。
+        loader が例外を送出した場合はキャッシュせずに呼び出し元へ伝える。
+        """
+        value = self._lookup(key)
+        if value is not _MISSING:
+            self.hits += 1
+            return value
+
+        task = self._inflight.get(key)
+        if task is not None:
+            self.coalesced += 1
+        else:
+            self.misses += 1
+            # ローダーは独立したタスクで実行し、呼び出し元がキャンセルされても他の待機者には影響させない
+            task = asyncio.ensure_future(self._load(key, loader))
+            task.add_done_callback(_retrieve_exception)
+            self._inflight[key] = task
+        return await asyncio.shield(task)
+
+    async def _load(self, key, loader):
+        """loader(key) を呼んで格納する。例外はキャッシュせずに待機者へ伝える"""
+        try:
+            value = await loader(key)
+        finally:
+            self._inflight.pop(key, None)
+        self.set(key, value)
+        return value
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "hit_ratio": self.hits / total if total else 0.0,
+        }
+
+class ExpiringCache:
+    """
+    挿入時刻順に並んだ期限付きの辞書 (重複送信チェック用)。
+
+    OrderedDict の先頭が常に最も古いエントリなので、期限切れの削除は
+    先頭から取り除くだけでよく、挿入・削除とも償却 O(1)。
+    maxsize を超えた場合も古い順に削除する。
+    """
+
+    def __init__(self, maxsize=10000, ttl=300):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()  # key -> (inserted_at, value)
+        self.inserted = 0
+        self.duplicates = 0
+        self.expired = 0
+        self.evicted = 0
+
+    def _expire(self):
+        deadline = time.monotonic() - self.ttl
+        while self._data:
+            key, (inserted_at, _) = next(iter(self._data.items()))
+            if inserted_at > deadline:
+                break
+            del self._data[key]
+            self.expired += 1
+
+    def __len__(self):
+        self._expire()
+        return len(self._data)
+
+    def __contains__(self, key):
+        self._expire()
+        return key in self._data
+
+    def get(self, key, default=None):
+        self._expire()
+        entry = self._data.get(key)
+        return default if entry is None else entry[1]
+
+    def add(self, key, value=None):
+        """key が未登録なら登録して True、登録済み (重複) なら False を返す"""
+        self._expire()
+        if key in self._data:
+            self.duplicates += 1
+            return False
+        self._data[key] = (time.monotonic(), value)
+        self.inserted += 1
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+            self.evicted += 1
+        return True
+
+    def __setitem__(self, key, value):
+        # 既存エントリは挿入時刻 (= 並び順) を保ったまま値だけ更新
+        entry = self._data.get(key)
+        if entry is None:
+            self.add(key, value)
+        else:
+            self._data[key] = (entry[0], value)
+
+    def pop(self, key, default=None):
+        entry = self._data.pop(key, None)
+        return default if entry is None else entry[1]
+
+    def stats(self):
+        return {
+            "size": len(self),
+            "maxsize": self.maxsize,
+            "inserted": self.inserted,
+            "duplicates": self.duplicates,
+            "expired": self.expired,
+            "evicted": self.evicted,
+        }
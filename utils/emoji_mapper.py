@@ -1,42 +1,171 @@
-from typing import Dict, Optional
+import asyncio
+import json
+import logging
+import os
+import re
+from typing import Dict, Optional, Set
+
+from config import SLACK_EMOJI_REFRESH_INTERVAL
+
+# Slack の絵文字名と Unicode の対応表 (python -m utils.emoji_mapper で作り直す)
+# {"emoji": [[絵文字, "名前 別名 ...", "肌の色2 肌の色3 ... 肌の色6" (あれば)], ...]}
+DATA_FILE = os.path.join(os.path.dirname(__file__), "emoji_data.json")
+
+VARIATION_SELECTOR = "\ufe0f"
+# Slack の skin-tone-2 〜 skin-tone-6
+SKIN_TONES = "\U0001F3FB\U0001F3FC\U0001F3FD\U0001F3FE\U0001F3FF"
+skin_tone_re = re.compile(f"[{SKIN_TONES}]")
+discord_custom_emoji_re = re.compile(r"<a?:(\w+):\d+>")
+
+def normalize_emoji(emoji: str) -> str:
+    """異体字セレクタの有無で別の絵文字として扱わないよう取り除く"""
+    return emoji.replace(VARIATION_SELECTOR, "")
 
 class EmojiMapper:
-    # SlackとDiscordの基本的な絵文字マッピング
+    # 研究室向けカスタム絵文字 (標準の絵文字にない名前だけ使う)
     EMOJI_MAP: Dict[str, str] = {
-        # 基本的な絵文字
-        ":smile:": "😊",
-        ":laughing:": "😄",
-        ":thumbsup:": "👍",
-        ":thumbsdown:": "👎",
-        ":heart:": "❤️",
-        ":warning:": "⚠️",
-        ":anger:": "💢",
-        ":star:": "⭐",
-        ":question:": "❓",
-        ":exclamation:": "❗",
-        ":ok:": "🆗",
-        ":pray:": "🙏",
-        ":clap:": "👏",
-        ":fire:": "🔥",
-        ":eyes:": "👀",
-        # 研究室向けカスタム絵文字
         ":paper:": "📄",
-        ":book:": "📚",
-        ":computer:": "💻",
-        ":bulb:": "💡",
-        ":calendar:": "📅",
         ":clock:": "⏰",
     }
 
+    _by_name: Dict[str, str] = {}     # Slack の名前 (name::skin-tone-N を含む) -> 絵文字
+    _by_emoji: Dict[str, str] = {}    # normalize_emoji した絵文字 -> Slack の名前
+    _custom: Set[str] = set()         # Slack ワークスペースのカスタム絵文字名
+    _aliases: Dict[str, str] = {}     # カスタム絵文字の別名 -> 元の名前
+
+    @classmethod
+    def load(cls, path: str = DATA_FILE) -> int:
+        """対応表を読み込んで両方向の索引を作る"""
+        with open(path, encoding="utf-8") as f:
+            rows = json.load(f)["emoji"]
+        by_name, by_emoji = {}, {}
+        for row in rows:
+            emoji, names = row[0], row[1].split(" ")
+            for name in names:
+                by_name.setdefault(name, emoji)
+            by_emoji.setdefault(normalize_emoji(emoji), names[0])
+            if len(row) > 2:
+                for tone, toned in enumerate(row[2].split(" "), start=2):
+                    for name in names:
+                        by_name.setdefault(f"{name}::skin-tone-{tone}", toned)
+                    by_emoji.setdefault(normalize_emoji(toned), f"{names[0]}::skin-tone-{tone}")
+        cls._by_name, cls._by_emoji = by_name, by_emoji
+        return len(rows)
+
     @classmethod
     def slack_to_discord(cls, slack_emoji: str) -> Optional[str]:
         """Slack形式の絵文字をDiscord形式に変換"""
-        return cls.EMOJI_MAP.get(slack_emoji)
+        name = slack_emoji.strip(":")
+        # カスタム絵文字の別名 (alias:) は元の絵文字にたどる
+        for _ in range(3):
+            if name not in cls._aliases:
+                break
+            name = cls._aliases[name]
+        emoji = cls._by_name.get(name)
+        if emoji is None and "::skin-tone-" in name:
+            # 肌の色の変種がない絵文字は元の絵文字にする
+            emoji = cls._by_name.get(name.split("::", 1)[0])
+        if emoji is None:
+            emoji = cls.EMOJI_MAP.get(f":{name}:")
+        return emoji
 
     @classmethod
     def discord_to_slack(cls, discord_emoji: str) -> Optional[str]:
         """Discord形式の絵文字をSlack形式に変換"""
-        for slack, discord in cls.EMOJI_MAP.items():
-            if discord == discord_emoji:
-                return slack
-        return None
\ No newline at end of file
+        custom = discord_custom_emoji_re.fullmatch(discord_emoji)
+        if custom:
+            # Discord のカスタム絵文字は Slack に同じ名前の絵文字があれば使う
+            name = custom.group(1)
+            if name in cls._custom or name in cls._by_name:
+                return f":{name}:"
+            return None
+        emoji = normalize_emoji(discord_emoji)
+        name = cls._by_emoji.get(emoji)
+        if name is None:
+            # 複数の肌の色を組み合わせた絵文字などは元の絵文字にする
+            name = cls._by_emoji.get(skin_tone_re.sub("", emoji))
+        return f":{name}:" if name else None
+
+    @classmethod
+    async def refresh_custom_emoji(cls, client) -> int:
+        """Slack の emoji.list でワークスペースのカスタム絵文字を取り直す"""
+        response = await client.emoji_list()
+        custom = response.get("emoji", {})
+        cls._aliases = {
+            name: value[len("alias:"):] for name, value in custom.items() if value.startswith("alias:")
+        }
+        cls._custom = set(custom)
+        return len(custom)
+
+    @classmethod
+    async def run_custom_emoji_refresh(cls, client, interval: float = SLACK_EMOJI_REFRESH_INTERVAL):
+        """起動時と interval 秒ごとにカスタム絵文字を取り直す"""
+        while True:
+            try:
+                count = await cls.refresh_custom_emoji(client)
+                logging.info(f"Loaded {count} Slack custom emoji")
+            except Exception as e:
+                logging.error(f"Failed to refresh Slack custom emoji: {e}")
+            await asyncio.sleep(interval)
+
+try:
+    EmojiMapper.load()
+except FileNotFoundError:
+    logging.error(f"Emoji data not found: {DATA_FILE}")
+
+def _codepoints(unified: str) -> str:
+    return "".join(chr(int(cp, 16)) for cp in unified.split("-"))
+
+def build_dataset(iamcal_path: str, path: str = DATA_FILE) -> int:
+    """
+    iamcal/emoji-data の emoji.json (Slack と同じ名前) から DATA_FILE を作る。
+    emoji パッケージがあれば、emoji.json にない新しい絵文字を CLDR の名前で補う。
+    """
+    with open(iamcal_path, encoding="utf-8") as f:
+        source = json.load(f)
+    rows = []
+    known = set()
+    for entry in sorted(source, key=lambda e: e.get("sort_order", 0)):
+        emoji = _codepoints(entry["unified"])
+        row = [emoji, " ".join(entry["short_names"])]
+        known.add(normalize_emoji(emoji))
+        variations = entry.get("skin_variations") or {}
+        if all(tone in variations for tone in ("1F3FB", "1F3FC", "1F3FD", "1F3FE", "1F3FF")):
+            toned = [_codepoints(variations[tone]["unified"]) for tone in ("1F3FB", "1F3FC", "1F3FD", "1F3FE", "1F3FF")]
+            row.append(" ".join(toned))
+            known.update(normalize_emoji(t) for t in toned)
+        rows.append(row)
+
+    try:
+        from emoji import EMOJI_DATA
+    except ImportError:
+        EMOJI_DATA = {}
+    extra = {}  # 肌の色を除いた絵文字 -> [名前, {肌の色: 絵文字}]
+    for emoji, data in EMOJI_DATA.items():
+        if data.get("status") != 2 or normalize_emoji(emoji) in known:
+            continue
+        tones = skin_tone_re.findall(emoji)
+        base = skin_tone_re.sub("", emoji)
+        entry = extra.setdefault(base, [None, {}])
+        if not tones:
+            entry[0] = " ".join(dict.fromkeys(
+                name.strip(":").lower() for name in [data["en"], *data.get("alias", [])]
+            ))
+        elif len(set(tones)) == 1:
+            entry[1][tones[0]] = emoji
+    for base, (names, toned) in extra.items():
+        if names is None:
+            continue
+        row = [base, names]
+        if len(toned) == len(SKIN_TONES):
+            row.append(" ".join(toned[tone] for tone in SKIN_TONES))
+        rows.append(row)
+
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({"emoji": rows}, f, ensure_ascii=False, separators=(",", ":"))
+    return len(rows)
+
+if __name__ == "__main__":
+    import sys
+    count = build_dataset(sys.argv[1])
+    print(f"Wrote {count} emoji to {DATA_FILE}")
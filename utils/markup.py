@@ -0,0 +1,364 @@
+"""
+Slack (mrkdwn) と Discord (Markdown) の書式の相互変換。
+
+書式ごとに両方の記法を CONSTRUCTS にまとめて定義し、変換元の記法から1つの正規表現を組み立てる。
+テキストは1回の走査で書式ごとに変換先の記法に置き換える (太字などの中身は入れ子で変換)。
+コードブロック・インラインコードの中身は変換しない。
+Slack から変換するときは Slack のエスケープのまま変換し、最後に1回でエスケープを戻す。
+"""
+import re
+
+SLACK = "slack"
+DISCORD = "discord"
+
+# Slack はテキスト中の & < > を &amp; &lt; &gt; にエスケープする
+def decode_slack_entities(text):
+    if "&" not in text:
+        return text
+    # &amp; を最後に戻す ("&amp;lt;" を "<" にしないため)
+    return text.replace("&lt;", "<").replace("&gt;", ">").replace("&amp;", "&")
+
+def encode_slack_entities(text):
+    if "&" not in text and "<" not in text and ">" not in text:
+        return text
+    return text.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;")
+
+class MentionNames:
+    """メンションの表示名 (ID は文字列で引く。分からなければ None)"""
+
+    def __init__(self, users=None, channels=None, roles=None):
+        self.users = {str(k): v for k, v in (users or {}).items()}
+        self.channels = {str(k): v for k, v in (channels or {}).items()}
+        self.roles = {str(k): v for k, v in (roles or {}).items()}
+
+class Construct:
+    """
+    1つの書式。patterns は記法ごとの正規表現 (グループ名は "<name>_" で始める)、
+    render は出力先の記法ごとの関数 render(match, body, names) -> str (None なら元のまま)。
+    nested なら <name>_body の中身も変換する。
+    emphasized なら出力を太字にする (すでに太字の中なら何もしない)。
+    ref はメンションのIDのグループ名 (refs で集める)。
+    """
+
+    def __init__(self, name, patterns, render, nested=False, emphasized=False, ref=None):
+        self.name = name
+        self.patterns = patterns
+        self.render = render
+        self.nested = nested
+        self.emphasized = emphasized
+        self.ref = ref
+
+def _alternatives(pattern):
+    """pattern をトップレベルの選択肢ごとに (先頭の文字, 残り) に分ける (選択肢はリテラルで始まること)"""
+    alternatives = []
+    depth = 0
+    in_class = escaped = False
+    start = 0
+    for i, ch in enumerate(pattern):
+        if escaped:
+            escaped = False
+        elif ch == "\\":
+            escaped = True
+        elif in_class:
+            in_class = ch != "]"
+        elif ch == "[":
+            in_class = True
+        elif ch == "(":
+            depth += 1
+        elif ch == ")":
+            depth -= 1
+        elif ch == "|" and depth == 0:
+            alternatives.append(pattern[start:i])
+            start = i + 1
+    alternatives.append(pattern[start:])
+    return [(alt[:2], alt[2:]) if alt.startswith("\\") else (alt[:1], alt[1:]) for alt in alternatives]
+
+# Slack から変換するときの出力は Slack のエスケープのまま組み立て、最後に1回だけ戻す
+# (名前など外から入れる文字列はエスケープしておく)
+
+def _link_to_discord(m, body, names):
+    url = m.group("link_url")
+    label = m.group("link_label")
+    if label is None:
+        return f"<{url}>"
+    if label.startswith("http://") or label.startswith("https://"):
+        return url  # just the raw link
+    return f"[{label}]({url})"
+
+def _link_to_slack(m, body, names):
+    return f"<{m.group('link_url')}|{m.group('link_label')}>"
+
+# Discord に名前の分からないメンションを残しても意味がないので Unknown にする
+def _user_to_discord(m, body, names):
+    return f"@{encode_slack_entities(names.users.get(m.group('user_id')) or 'Unknown')}"
+
+def _user_to_slack(m, body, names):
+    name = names.users.get(m.group("user_id"))
+    return f"@{name}" if name else None
+
+def _channel_to_discord(m, body, names):
+    name = names.channels.get(m.group("channel_id"))
+    if name:
+        return f"#{encode_slack_entities(name)}"
+    return f"#{m.group('channel_name') or 'Unknown'}"
+
+def _channel_to_slack(m, body, names):
+    name = names.channels.get(m.group("channel_id"))
+    return f"#{name}" if name else None
+
+def _role_to_slack(m, body, names):
+    name = names.roles.get(m.group("role_id"))
+    return f"@{name}" if name else None
+
+_BROADCAST_TO_DISCORD = {"channel": "@everyone", "everyone": "@everyone", "here": "@here"}
+_BROADCAST_TO_SLACK = {"everyone": "<!channel>", "here": "<!here>"}
+
+# 先に書いたものほど優先される
+CONSTRUCTS = [
+    Construct(
+        "code_block",
+        {SLACK: r"```(?P<code_block_body>.*?)```", DISCORD: r"```(?P<code_block_body>.*?)```"},
+        {SLACK: lambda m, body, names: f"```{body}```", DISCORD: lambda m, body, names: f"```{body}```"},
+    ),
+    Construct(
+        "code",
+        {SLACK: r"`(?P<code_body>[^`\n]+)`", DISCORD: r"`(?P<code_body>[^`\n]+)`"},
+        {SLACK: lambda m, body, names: f"`{body}`", DISCORD: lambda m, body, names: f"`{body}`"},
+    ),
+    Construct(
+        "link",
+        {
+            SLACK: r"<(?P<link_url>https?://[^|>\s]+)(?:\|(?P<link_label>[^>]+))?>",
+            DISCORD: r"\[(?P<link_label>[^\]\n]+)\]\((?P<link_url>https?://[^)\s]+)\)",
+        },
+        {SLACK: _link_to_slack, DISCORD: _link_to_discord},
+    ),
+    # Discord の生のURLは書式として解釈しない (URL 中の * _ ~ を守る)
+    Construct(
+        "url",
+        {DISCORD: r"<https?://[^\s>]+>|https?://[^\s<]+"},
+        {SLACK: lambda m, body, names: m.group(0)},
+    ),
+    Construct(
+        "user",
+        {SLACK: r"<@(?P<user_id>[UW][A-Z0-9]+)(?:\|[^>]*)?>", DISCORD: r"<@!?(?P<user_id>\d+)>"},
+        {SLACK: _user_to_slack, DISCORD: _user_to_discord},
+        emphasized=True,
+        ref="user_id",
+    ),
+    Construct(
+        "role",
+        {DISCORD: r"<@&(?P<role_id>\d+)>"},
+        {SLACK: _role_to_slack},
+        emphasized=True,
+        ref="role_id",
+    ),
+    Construct(
+        "channel",
+        {
+            SLACK: r"<#(?P<channel_id>C[A-Z0-9]+)(?:\|(?P<channel_name>[^>]*))?>",
+            DISCORD: r"<#(?P<channel_id>\d+)>",
+        },
+        {SLACK: _channel_to_slack, DISCORD: _channel_to_discord},
+        emphasized=True,
+        ref="channel_id",
+    ),
+    Construct(
+        "broadcast",
+        {SLACK: r"<!(?P<broadcast_name>channel|here|everyone)(?:\|[^>]*)?>", DISCORD: r"@(?P<broadcast_name>everyone|here)\b"},
+        {
+            SLACK: lambda m, body, names: _BROADCAST_TO_SLACK[m.group("broadcast_name")],
+            DISCORD: lambda m, body, names: _BROADCAST_TO_DISCORD[m.group("broadcast_name")],
+        },
+    ),
+    Construct(
+        "bold_italic",
+        {DISCORD: r"\*\*\*(?P<bold_italic_body>[^\n]+?)\*\*\*"},
+        {SLACK: lambda m, body, names: f"*_{body}_*"},
+        nested=True,
+    ),
+    Construct(
+        "bold",
+        {SLACK: r"\*(?P<bold_body>[^*\n]+?)\*", DISCORD: r"\*\*(?P<bold_body>[^\n]+?)\*\*"},
+        {SLACK: lambda m, body, names: f"*{body}*", DISCORD: lambda m, body, names: f"**{body}**"},
+        nested=True,
+    ),
+    Construct(
+        "strike",
+        {SLACK: r"~(?P<strike_body>[^~\n]+?)~", DISCORD: r"~~(?P<strike_body>[^\n]+?)~~"},
+        {SLACK: lambda m, body, names: f"~{body}~", DISCORD: lambda m, body, names: f"~~{body}~~"},
+        nested=True,
+    ),
+    # Slack の _italic_ と Discord の _italic_ は同じ記法なのでそのまま通す
+    Construct(
+        "italic",
+        {DISCORD: r"\*(?P<italic_body>[^*\n]+?)\*"},
+        {SLACK: lambda m, body, names: f"_{body}_"},
+        nested=True,
+    ),
+]
+
+# 中身のメンションを太字にしなくてよい書式
+_BOLD = ("bold", "bold_italic")
+
+class MarkupTransformer:
+    """source の記法で書かれたテキストを target の記法に変換する"""
+
+    def __init__(self, source, target, constructs=CONSTRUCTS):
+        self.source = source
+        self.target = target
+        self._constructs = {c.name: c for c in constructs if source in c.patterns}
+        self._bold = next(c for c in constructs if c.name == "bold").render[target]
+        # 選択肢がすべてリテラルで始まると、re は先頭になりうる文字まで読み飛ばしてから照合する。
+        # そのため先頭の文字は名前付きグループの外に出す (どの書式かは lastgroup で分かる)
+        branches = []
+        leads = set()
+        groups = {}  # 外側のグループ名 -> 書式
+        for c in self._constructs.values():
+            for i, (lead, rest) in enumerate(_alternatives(c.patterns[source])):
+                group = c.name if i == 0 else f"{c.name}__{i}"
+                groups[group] = c
+                branches.append(f"{lead}(?P<{group}>{rest})")
+                leads.add(lead)
+        self._regex = re.compile("|".join(branches), re.DOTALL)
+        # 先頭の文字を含まないテキストは変換しなくてよい
+        self._lead_re = re.compile("|".join(sorted(leads)))
+        # 外側のグループ名ごとに (書式, 中身のグループ名, 出力関数) を引けるようにしておく
+        self._rules = {
+            group: (c, f"{c.name}_body" if f"{c.name}_body" in self._regex.groupindex else None, c.render[target])
+            for group, c in groups.items()
+        }
+        # Slack のエスケープは変換し終えてから1回で戻す (コードなどの中身も戻す)
+        self._decode = decode_slack_entities if source == SLACK else None
+        # transform 用に、外側のグループ名ごとの変換関数を太字の外/中の2通り作っておく
+        self._handlers = {}
+        for in_bold in (False, True):
+            self._handlers[in_bold] = {group: self._handler(rule, in_bold) for group, rule in self._rules.items()}
+        # メンションのIDだけを拾う正規表現 (transform の前に名前を引くため)
+        refs = [c for c in self._constructs.values() if c.ref]
+        self._ref_regex = re.compile("|".join(c.patterns[source] for c in refs))
+        # findall が返すタプルの中での位置
+        self._ref_groups = {c.name: self._ref_regex.groupindex[c.ref] - 1 for c in refs}
+
+    def _handler(self, rule, in_bold):
+        """match -> 出力 の関数 (書式ごとの分岐を先に済ませておき、1件ごとの処理を減らす)"""
+        construct, body_group, render = rule
+        if construct.nested:
+            lead_search = self._lead_re.search
+            sub = self._sub
+            inner = in_bold or construct.name in _BOLD
+
+            def nested(match, names):
+                body = match.group(body_group)
+                if lead_search(body):
+                    body = sub(body, names, inner)
+                text = render(match, body, names)
+                return match.group(0) if text is None else text
+
+            return nested
+        bold = self._bold if construct.emphasized and not in_bold else None
+        if bold is None:
+            # コード・リンク・特殊メンションなど (太字の中のメンションも)
+            def leaf(match, names):
+                text = render(match, None if body_group is None else match.group(body_group), names)
+                return match.group(0) if text is None else text
+
+            return leaf
+
+        def emphasized(match, names):
+            text = render(match, None if body_group is None else match.group(body_group), names)
+            return match.group(0) if text is None else bold(match, text, names)
+
+        return emphasized
+
+    def refs(self, text):
+        """
+        text 中のメンションのIDを 書式名 -> IDの集合 で返す (transform の前に名前を引くため)。
+        コードの中のものも数える (名前を余分に引くことがあるだけで、走査は正規表現だけで済む)
+        """
+        found = self._ref_regex.findall(text)
+        if not found:
+            return {}
+        refs = {}
+        for name, i in self._ref_groups.items():
+            ids = {groups[i] for groups in found if groups[i]}
+            if ids:
+                refs[name] = ids
+        return refs
+
+    def transform(self, text, names=None, in_bold=False):
+        """
+        text を1回の走査で変換する。メンションの名前は refs で集めたIDについて先に引いておく
+        """
+        # 書式の先頭になりうる文字がなければ置き換えるものはない
+        if self._lead_re.search(text):
+            text = self._sub(text, names or MentionNames(), in_bold)
+        return self._decode(text) if self._decode else text
+
+    def _sub(self, text, names, in_bold):
+        handlers = self._handlers[in_bold]
+        return self._regex.sub(lambda match: handlers[match.lastgroup](match, names), text)
+
+def _trie_pattern(words):
+    """words のどれかに一致する正規表現。共通の接頭辞をまとめ、同じ位置では長いものから試す"""
+    trie = {}
+    for word in words:
+        node = trie
+        for ch in word:
+            node = node.setdefault(ch, {})
+        node[""] = True
+
+    def emit(node):
+        branches = [re.escape(ch) + emit(child) for ch, child in sorted(node.items()) if ch]
+        if not branches:
+            return ""
+        if "" in node:
+            return f"(?:{'|'.join(branches)})?"
+        return branches[0] if len(branches) == 1 else f"(?:{'|'.join(branches)})"
+
+    return emit(trie)
+
+class MultiReplacer:
+    """
+    (置換前, 置換後) の対応表をまとめて1回の走査で置き換える。
+    同じ位置では最長一致、置換前が重複していれば先に書いたものを使い、置換結果は再び置き換えない。
+    pairs は対応表を返す関数で、最初の呼び出し・version の値が変わったとき・invalidate の後に読み直す。
+    version は対応表の元のリストの (id, 長さ) など、毎回呼んでも安い値を返す関数 (省略可)。
+    """
+
+    def __init__(self, pairs, version=None):
+        self._pairs = pairs
+        self._version = version
+        self._built_version = None
+        self._dirty = True
+        self._table = {}
+        self._regex = None
+
+    def invalidate(self):
+        """対応表を書き換えたら呼ぶ (次の呼び出しで作り直す)"""
+        self._dirty = True
+
+    def _build(self, pairs):
+        table = {}
+        for before, after in pairs:
+            if before and before not in table:
+                table[before] = after
+        self._table = table
+        self._regex = re.compile(_trie_pattern(table)) if table else None
+        self._dirty = False
+
+    def __call__(self, text):
+        if self._version is not None:
+            version = self._version()
+            if version != self._built_version:
+                self._dirty = True
+                self._built_version = version
+        if self._dirty:
+            self._build(self._pairs())
+        if self._regex is None:
+            return text
+        table = self._table
+        return self._regex.sub(lambda m: table[m.group(0)], text)
+
+stod_markup = MarkupTransformer(SLACK, DISCORD)
+dtos_markup = MarkupTransformer(DISCORD, SLACK)